@@ -16,6 +16,7 @@ class OperationDTO:
     comment: Optional[str] = ""
     operation_id: Optional[str] = ""
     _sort_key: Optional[str] = field(init=False, default=None)
+    _sort_ts: int = field(init=False, default=0)
 
     def __post_init__(self):
         if self.date:
@@ -25,6 +26,12 @@ class OperationDTO:
                 # Можно было бы даже преобразовать строку в datetime
                 # self.date = datetime.strptime(self.date, "%Y-%m-%d %H:%M:%S")
             self._sort_key = str(self.date)
+            # Числовой ключ YYYYMMDDhhmmss для слияния отсортированных серий операций
+            key = self._sort_key
+            try:
+                self._sort_ts = int(key[0:4] + key[5:7] + key[8:10] + key[11:13] + key[14:16] + key[17:19])
+            except ValueError:
+                self._sort_ts = 0
         else:
             self._sort_key = ""
 
@@ -40,7 +47,7 @@ class OperationDTO:
         # Если date - это datetime, преобразуем его в строку для сериализации
         if isinstance(self.date, datetime):
             result['date'] = self.date.isoformat()
-        # Удаляем служебное поле
-        if '_sort_key' in result:
-            del result['_sort_key']
+        # Удаляем служебные поля
+        for key in [k for k in result if k.startswith('_')]:
+            del result[key]
         return result
\ No newline at end of file
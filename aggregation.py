@@ -0,0 +1,75 @@
+from typing import Any, Dict, List, Tuple
+
+from OperationDTO import OperationDTO
+
+#  Длина префикса _sort_key ('YYYY-MM-DD HH:MM:SS'), задающего период агрегации
+AGGREGATION_PERIODS = {
+    "day": 10,
+    "month": 7,
+    "year": 4,
+    "all": 0,
+}
+
+#  Знак изменения позиции по типу операции
+POSITION_SIGNS = {
+    "buy": 1,
+    "currency_buy": 1,
+    "sale": -1,
+    "currency_sale": -1,
+}
+
+
+class OperationAggregator:
+    """
+    Накопительные итоги по операциям в одном проходе по их потоку.
+    Итоги ведутся по ключу (isin, ticker, currency, operation_type, период),
+    позиции — по (ticker, isin).
+    """
+
+    def __init__(self, period: str = "month") -> None:
+        if period not in AGGREGATION_PERIODS:
+            raise ValueError(f"Неподдерживаемый период агрегации: {period}")
+        self.period = period
+        self._period_len = AGGREGATION_PERIODS[period]
+        # ключ -> [количество операций, сумма платежей, количество бумаг, НКД]
+        self._totals: Dict[Tuple[Any, ...], List[float]] = {}
+        self._positions: Dict[Tuple[Any, ...], float] = {}
+
+    def add(self, op: OperationDTO) -> None:
+        period = op._sort_key[:self._period_len] if self._period_len else ""
+        key = (op.isin, op.ticker, op.currency, op.operation_type, period)
+        totals = self._totals.get(key)
+        if totals is None:
+            totals = self._totals[key] = [0, 0.0, 0, 0.0]
+        totals[0] += 1
+        totals[1] += op.payment_sum or 0.0
+        totals[2] += op.quantity or 0
+        totals[3] += op.aci or 0.0
+
+        sign = POSITION_SIGNS.get(op.operation_type)
+        if sign:
+            position_key = (op.ticker, op.isin)
+            self._positions[position_key] = self._positions.get(position_key, 0) + sign * (op.quantity or 0)
+
+    def result(self) -> Dict[str, Any]:
+        totals = [
+            {
+                "isin": isin,
+                "ticker": ticker,
+                "currency": currency,
+                "operation_type": operation_type,
+                "period": period,
+                "count": count,
+                "payment_sum": payment_sum,
+                "quantity": quantity,
+                "aci": aci,
+            }
+            for (isin, ticker, currency, operation_type, period), (count, payment_sum, quantity, aci)
+            in self._totals.items()
+        ]
+        positions = [
+            {"ticker": ticker, "isin": isin, "quantity": quantity}
+            for (ticker, isin), quantity in self._positions.items()
+        ]
+        return {"period": self.period, "totals": totals, "positions": positions}
+
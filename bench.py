@@ -0,0 +1,194 @@
+"""
+Микробенчмарки горячих участков разбора отчетов.
+
+Каждый режим печатает лучшее время из нескольких повторов, чтобы цифры
+из описаний изменений можно было воспроизвести на своей машине:
+    cash  — разбор таблицы движения ДС (parse_financial_operations), строк/с
+    regex — помощники patterns против исходных re.search/re.match по строке
+            шаблона на типичных ячейках отчета, нс/вызов
+    memory — память, удерживаемая разобранными операциями (tracemalloc),
+             с пулом строк StringPool и без него
+
+Пример:
+    python bench.py cash --rows 200000 --repeat 3
+    python bench.py regex --number 200
+    python bench.py memory --file statement.xlsx
+"""
+import argparse
+import contextlib
+import gc
+import io
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, Optional, Tuple, Type
+
+from fin import parse_trades
+from final import parse_financial_operations
+from loadtest import CASH_OPERATIONS, ISINS, build_statement
+from patterns import find_isin, is_currency_pair, is_ru_ticker, match_section_number
+from sections import build_section_index
+from utils import StringPool, extract_rows
+
+
+def best_time(fn: Callable[[], Any], repeat: int) -> float:
+    """Лучшее время одного вызова fn из repeat повторов, с."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def build_cash_rows(count: int, seed: int = 0) -> List[List[Any]]:
+    """Строки отчета в памяти: шапка и одна рублевая таблица движения ДС из count строк."""
+    rnd = random.Random(seed)
+    rows: List[List[Any]] = [
+        [None, "Генеральное соглашение: 100000 от 01.02.2020"],
+        [None, "Период: с 01.01.2023 по 31.12.2023"],
+        [None, "RUB"],
+        [None, "Дата", "Операция", "Сумма зачисления", "Сумма списания", "Примечание", None, None, None],
+    ]
+    day = datetime(2023, 1, 1)
+    for _ in range(count):
+        day += timedelta(minutes=rnd.randint(0, 600))
+        income = round(rnd.random() * 1000, 2) if rnd.random() < 0.5 else 0
+        expense = 0 if income else round(rnd.random() * 500, 2)
+        rows.append([None, day, rnd.choice(CASH_OPERATIONS), income, expense,
+                     f"Выплата {rnd.choice(ISINS)}", None, None, None])
+    return rows
+
+
+def bench_cash(args: argparse.Namespace) -> None:
+    rows = build_cash_rows(args.rows, args.seed)
+    operations: List[Any] = []
+
+    def run() -> None:
+        operations[:] = parse_financial_operations(rows)[1]
+
+    elapsed = best_time(run, args.repeat)
+    print(f"cash: {args.rows} строк, {len(operations)} операций, "
+          f"{args.rows / elapsed:,.0f} строк/с ({elapsed:.3f} с)")
+
+
+#  Ячейки, которые парсеры проверяют регулярными выражениями: примечания
+#  операций, первые ячейки строк сделок, коды бумаг и заголовки разделов
+REGEX_CELLS = [
+    "Комиссия", "Выплата купона RU000A0JX0J2 по бумаге", "Перевод средств между счетами клиента", "",
+    "CNYRUB_TOM", "USDRUB_TOM", "SBER", "Итого по акциям", "Акция",
+    "RU000A0JX0J2", "RU000123456", "ISIN: RU000A0JX0J2", "Облигация",
+    "2.1. Сделки:", "2.2. Сделки РЕПО:", "3. Активы:", "Дата", "1001",
+]
+
+
+def inline_find_isin(text: str) -> str:
+    match = re.search(r'\b[A-Z]{2}[A-Z0-9]{10}\b', text)
+    return match.group(0) if match else ""
+
+
+def inline_is_currency_pair(text: str) -> bool:
+    return re.match(r'^[A-Z]{3,}RUB_[A-Z]+$', text) is not None
+
+
+def inline_is_ru_ticker(text: str) -> bool:
+    return re.match(r'^RU\d{9}$', text) is not None
+
+
+def inline_match_section_number(text: str) -> Optional[str]:
+    match = re.match(r'^(\d+(?:\.\d+)*)\.\s', text)
+    return match.group(1) if match else None
+
+
+REGEX_CASES: List[Tuple[str, Callable[[str], Any], Callable[[str], Any]]] = [
+    ("find_isin", find_isin, inline_find_isin),
+    ("is_currency_pair", is_currency_pair, inline_is_currency_pair),
+    ("is_ru_ticker", is_ru_ticker, inline_is_ru_ticker),
+    ("match_section_number", match_section_number, inline_match_section_number),
+]
+
+
+def bench_regex(args: argparse.Namespace) -> None:
+    cells = REGEX_CELLS * 100
+    print(f"regex: {len(cells)} ячеек, нс/вызов (patterns / исходный re)")
+    for name, helper, inline in REGEX_CASES:
+        assert [helper(c) for c in cells] == [inline(c) for c in cells], name
+        timings = []
+        for fn in (helper, inline):
+            elapsed = best_time(lambda: [fn(c) for _ in range(args.number) for c in cells], args.repeat)
+            timings.append(elapsed / len(cells) / args.number * 1e9)
+        print(f"  {name:22s} {timings[0]:7.0f} / {timings[1]:7.0f}")
+
+
+class PassThroughPool(StringPool):
+    """Пул без интернирования: каждое значение остается отдельным объектом, как до StringPool."""
+
+    def intern(self, value: Optional[str]) -> Optional[str]:
+        return value
+
+
+def retained_memory(rows: List[List[Any]], pool_class: Type[StringPool]) -> Tuple[int, int]:
+    """Число операций и байты, которые они удерживают после разбора (сам пул уже освобожден)."""
+    index = build_section_index(rows)
+    gc.collect()
+    tracemalloc.start()
+    pool = pool_class()
+    with contextlib.redirect_stdout(io.StringIO()):
+        operations = parse_financial_operations(rows, index, pool)[1]
+        operations += parse_trades(rows=rows, index=index, pool=pool)
+    del pool
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(operations), retained
+
+
+def bench_memory(args: argparse.Namespace) -> None:
+    if args.file:
+        rows = list(extract_rows(args.file))
+    else:
+        with tempfile.TemporaryDirectory(prefix="parsing-bench-") as work_dir:
+            path = os.path.join(work_dir, "statement.xlsx")
+            build_statement(path, args.cash_rows, args.trade_rows, seed=args.seed)
+            rows = list(extract_rows(path))
+
+    print(f"memory: {args.file or f'{args.cash_rows} строк ДС, {args.trade_rows} сделок'}")
+    for name, pool_class in (("StringPool", StringPool), ("без пула", PassThroughPool)):
+        count, retained = retained_memory(rows, pool_class)
+        print(f"  {name:12s} {count} операций, {retained / 1e6:.1f} МБ")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Микробенчмарки разбора отчетов")
+    modes = parser.add_subparsers(dest="mode", required=True)
+
+    cash = modes.add_parser("cash", help="Разбор таблицы движения ДС")
+    cash.add_argument("--rows", type=int, default=200000, help="Строк в таблице")
+    cash.add_argument("--repeat", type=int, default=3, help="Повторов замера")
+    cash.add_argument("--seed", type=int, default=0)
+    cash.set_defaults(run=bench_cash)
+
+    regex = modes.add_parser("regex", help="Регулярные выражения разбора")
+    regex.add_argument("--number", type=int, default=50, help="Проходов по ячейкам за замер")
+    regex.add_argument("--repeat", type=int, default=5, help="Повторов замера")
+    regex.set_defaults(run=bench_regex)
+
+    memory = modes.add_parser("memory", help="Память разобранных операций")
+    memory.add_argument("--file", help="Отчет .xls/.xlsx (по умолчанию — синтетический)")
+    memory.add_argument("--cash-rows", type=int, default=20000, help="Строк ДС в синтетическом отчете")
+    memory.add_argument("--trade-rows", type=int, default=10000, help="Сделок в синтетическом отчете")
+    memory.add_argument("--seed", type=int, default=0)
+    memory.set_defaults(run=bench_memory)
+
+    args = parser.parse_args()
+    logging.disable(logging.CRITICAL)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
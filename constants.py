@@ -1,46 +1,14 @@
-from utils import is_nonzero
+from format_profiles import DEFAULT_PROFILE, get_profile
+
+#  Словари формата по умолчанию. Источник — скомпилированный профиль
+#  formats/<профиль>.json (см. format_profiles.get_profile)
+_DEFAULT_PROFILE = get_profile(DEFAULT_PROFILE)
 
 #  Валидные операции, которые обрабатываются
-VALID_OPERATIONS = {
-    "Вознаграждение компании",
-    "Дивиденды",
-    "НДФЛ",
-    "Погашение купона",
-    "Погашение облигации",
-    "Приход ДС",
-    "Проценты по займам \"овернайт\"",
-    "Проценты по займам \"овернайт ЦБ\"",
-    "Частичное погашение облигации",
-    "Вывод ДС",
-}
+VALID_OPERATIONS = {op for op, rule in _DEFAULT_PROFILE.operation_rules.items() if not rule.skip}
 
 #  Операции, которые нужно игнорировать
-SKIP_OPERATIONS = {
-    "Внебиржевая сделка FX (22*)",
-    "Займы \"овернайт\"",
-    "НКД от операций",
-    "Покупка/Продажа",
-    "Покупка/Продажа (репо)",
-    "Переводы между площадками",
-}
-
-#  Маппинг строковых названий операций на типы
-OPERATION_TYPE_MAP = {
-    "Дивиденды": "dividend",
-    "Погашение купона": "coupon",
-    "Погашение облигации": "repayment",
-    "Приход ДС": "deposit",
-    "Частичное погашение облигации": "amortization",
-    "Вывод ДС": "withdrawal",
-}
-
-#  Обработка операций, тип которых зависит от контекста (доход/расход)
-SPECIAL_OPERATION_HANDLERS = {
-    'Проценты по займам "овернайт"': lambda i, e: "other_income" if is_nonzero(i) else "other_expense",
-    'Проценты по займам "овернайт ЦБ"': lambda i, e: "other_income" if is_nonzero(i) else "other_expense",
-    "Вознаграждение компании": lambda i, e: "commission_refund" if is_nonzero(i) else "commission",
-    "НДФЛ": lambda i, e: "refund" if is_nonzero(i) else "withholding",
-}
+SKIP_OPERATIONS = {op for op, rule in _DEFAULT_PROFILE.operation_rules.items() if rule.skip and op}
 
 
 TRADE_TYPE_CONFIG = {
@@ -88,56 +56,10 @@ TRADE_TYPE_CONFIG = {
     }
 }
 
-HEADER_VARIATIONS_TRADES = {
-    "stock": {
-        "operation_id": ["номер"],
-        "buy_quantity": ["куплено", "количеств"],
-        "buy_payment": ["сумма платежа", "платеж"],
-        "sell_quantity": ["продано", "количеств"],
-        "sell_revenue": ["сумма выручки", "выручка"],
-        "price": ["цена"],
-        "currency": ["валют"],
-        "date": ["дата соверш"],
-        "time": ["время соверш"],
-        "comment": ["примеч", "коммент"]
-    },
-    "bond": {
-        "operation_id": ["Номер"],
-        "buy_quantity": ["куплено", "количеств"],
-        "buy_payment": ["сумма платежа", "платеж"],
-        "sell_quantity": ["продано", "количеств"],
-        "sell_revenue": ["сумма выручки", "выручка"],
-        "price": ["цена"],
-        "aci": ["нкд", "НКД Продажи"],
-        "currency": ["валют"],
-        "date": ["дата соверш"],
-        "time": ["время соверш"],
-        "comment": ["примеч", "коммент"]
-    },
-    "currency": {
-        "operation_id": ["номер"],
-        "buy_price": ["курс сделки (покупка)"],
-        "buy_quantity": ["объём в валюте лота (в ед. валюты)"],
-        "buy_payment": ["объём в сопряж. валюте (в ед. валюты)"],
-        "sell_price": ["курс сделки (продажа)"],
-        "sell_quantity": ["объём в валюте лота (в ед. валюты)"],
-        "sell_payment": ["объём в сопряж. валюте (в ед. валюты)"],
-        "date": ["дата соверш"],
-        "time": ["время соверш"],
-        "comment": ["примеч", "коммент"]
-    }
-}
-
-#  Нормализация валют
-CURRENCY_DICT = {
-    "AED": "AED", "AMD": "AMD", "BYN": "BYN", "CHF": "CHF", "CNY": "CNY",
-    "EUR": "EUR", "GBP": "GBP", "HKD": "HKD", "JPY": "JPY", "KGS": "KGS",
-    "KZT": "KZT", "NOK": "NOK", "RUB": "RUB", "РУБЛЬ": "RUB", "Рубль": "RUB",
-    "SEK": "SEK", "TJS": "TJS", "TRY": "TRY", "USD": "USD", "UZS": "UZS",
-    "XAG": "XAG", "XAU": "XAU", "ZAR": "ZAR"
-}
-
-
-
+#  Ключевые слова подразделов раздела "2.1. Сделки:"
+SECTION_KEYWORDS = _DEFAULT_PROFILE.section_keywords
 
+HEADER_VARIATIONS_TRADES = _DEFAULT_PROFILE.header_variations_trades
 
+#  Нормализация валют
+CURRENCY_DICT = _DEFAULT_PROFILE.currencies
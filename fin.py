@@ -1,12 +1,22 @@
-import re
 from datetime import datetime
+from itertools import chain
 from typing import Any, List, Optional, Tuple, Dict
 
 import xlrd
 
 from OperationDTO import OperationDTO
 from constants import CURRENCY_DICT, HEADER_VARIATIONS_TRADES
-from utils import extract_rows, normalize_str, parse_date,  safe_float
+from format_profiles import FormatProfile, get_profile
+from patterns import is_ru_ticker
+from sections import (
+    ParseProgress,
+    SectionIndex,
+    build_section_index,
+    is_isin_row,
+    is_trade_noise_row,
+    match_currency_pair,
+)
+from utils import StringPool, extract_rows, normalize_str, parse_date,  safe_float
 
 
 def parse_time(value: Any) -> str:
@@ -25,15 +35,20 @@ def parse_time(value: Any) -> str:
                 continue
     return "00:00:00"
 
-def normalize_currency(value: Any) -> str:
+def normalize_currency(value: Any, currencies: Optional[Dict[str, str]] = None) -> str:
     value = str(value).strip().upper() if value else ""
-    return CURRENCY_DICT.get(value, value)
+    return (currencies or CURRENCY_DICT).get(value, value)
 
-def build_trade_col_map(header_row: List[Any], trade_type: str) -> Dict[str, List[int]]:
+def build_trade_col_map(
+    header_row: List[Any],
+    trade_type: str,
+    header_variations: Optional[Dict[str, Dict[str, list]]] = None
+) -> Dict[str, List[int]]:
     """
     Построение словаря field -> список индексов на основе HEADER_VARIATIONS_TRADES
+    (или вариантов заголовков из профиля формата)
     """
-    variations = HEADER_VARIATIONS_TRADES.get(trade_type, {})
+    variations = (header_variations or HEADER_VARIATIONS_TRADES).get(trade_type, {})
     col_map: Dict[str, List[int]] = {}
     for idx, cell in enumerate(header_row):
         text = str(cell or "").strip().lower()
@@ -51,10 +66,13 @@ def parse_trade_row(
     ticker: str,
     currency_hint: Optional[str],
     col_idx: Dict[str, List[int]],
-    isin: Optional[str] = ""
+    isin: Optional[str] = "",
+    pool: Optional[StringPool] = None,
+    currencies: Optional[Dict[str, str]] = None
 ) -> OperationDTO:
     """
     Динамический разбор строки сделки по map col_idx, поддерживает повторяющиеся названия колонок.
+    Строковые поля берутся из пула pool, если он передан.
     """
     def safe_index(key: str, default: int = -1, pos: int = 0) -> int:
         if key not in col_idx:
@@ -97,7 +115,7 @@ def parse_trade_row(
     trade_time = parse_time(row[time_idx]) if time_idx >= 0 and time_idx < len(row) else "00:00:00"
 
     # Явно берём валюту, даже если нет соответствующей колонки
-    currency = normalize_currency(row[curr_idx]) if curr_idx >= 0 and curr_idx < len(row) else currency_hint
+    currency = normalize_currency(row[curr_idx], currencies) if curr_idx >= 0 and curr_idx < len(row) else currency_hint
     comment = normalize_str(row[comment_idx]) if comment_idx >= 0 and comment_idx < len(row) else ""
     aci = safe_float(row[aci_idx]) if aci_idx >= 0 and aci_idx < len(row) else 0.0
     operation_id = str(row[opid_idx]).strip() if opid_idx >= 0 and opid_idx < len(row) else ""
@@ -111,12 +129,20 @@ def parse_trade_row(
     else:
         op_type = f"{trade_type}_{op_key}"
 
+    ticker = normalize_str(ticker)
+    if pool is not None:
+        currency = pool.intern(currency)
+        ticker = pool.intern(ticker)
+        isin = pool.intern(isin)
+        comment = pool.intern(comment)
+        op_type = pool.intern(op_type)
+
     return OperationDTO(
         date=full_date,
         operation_type=op_type,
         payment_sum=payment,
         currency=currency,
-        ticker=normalize_str(ticker),
+        ticker=ticker,
         isin=isin,
         price=price,
         quantity=quantity,
@@ -126,57 +152,81 @@ def parse_trade_row(
     )
 
 
-SECTION_KEYWORDS = {
-    'stock': ['акция', 'адр'],
-    'bond': ['облигация'],
-    'currency': ['иностранная валюта']
-}
-
-def parse_trades(filepath: str) -> List[OperationDTO]:
-    rows = list(extract_rows(filepath))
-
-    result: List[OperationDTO] = []
+def parse_trades(
+    filepath: Optional[str] = None,
+    rows: Optional[List[List[Any]]] = None,
+    index: Optional[SectionIndex] = None,
+    pool: Optional[StringPool] = None,
+    profile: Optional[FormatProfile] = None,
+) -> List[OperationDTO]:
+    return list(chain.from_iterable(parse_trade_runs(filepath, rows, index, pool, profile)))
+
+
+def parse_trade_runs(
+    filepath: Optional[str] = None,
+    rows: Optional[List[List[Any]]] = None,
+    index: Optional[SectionIndex] = None,
+    pool: Optional[StringPool] = None,
+    profile: Optional[FormatProfile] = None,
+    progress: Optional[ParseProgress] = None,
+) -> List[List[OperationDTO]]:
+    """
+    Разбор раздела "2.1. Сделки:". Если переданы уже прочитанные строки и индекс
+    разделов, файл повторно не читается и обходятся только строки раздела сделок.
+    Сделки возвращаются сериями — новая серия начинается с каждым подразделом
+    и каждым инструментом (тикер/ISIN), в порядке отчета.
+    """
+    profile = profile or get_profile()
+    header_variations = profile.header_variations_trades
+    if rows is None:
+        rows = list(extract_rows(filepath))
+    if index is None:
+        index = build_section_index(rows, profile)
+    if pool is None:
+        pool = StringPool()
+
+    runs: List[List[OperationDTO]] = [[]]
     current_ticker = current_isin = current_currency = None
     current_section = None
-    parsing_trades = False
     col_idx: Dict[str, List[int]] = {}
+    section_starts = {rng.start: section for section, rng in index.trade_subsections}
 
-    for row in rows:
-        row = row[1:]  # Пропускаем первую колонку
-        joined_row = ' '.join(map(str, row)).strip().lower()
-
-        # Старт раздела сделок
-        if not parsing_trades:
-            if '2.1. сделки:' in joined_row:
-                parsing_trades = True
-            continue
+    for row_num in index.trades:
+        row = rows[row_num][1:]  # Пропускаем первую колонку
 
         # Пропуск строк с "итого" или пустых строк
-        if 'итого по' in joined_row or not any(cell for cell in row):
+        if is_trade_noise_row(row):
             continue
 
         # Определяем тикер для валютных пар (CNYRUB_TOM, USDRUB_TOM и т.д.)
-        if isinstance(row[0], str) and re.match(r'^[A-Z]{3,}RUB_[A-Z]+$', row[0]):
-            current_ticker = row[0].strip()
+        pair_ticker = match_currency_pair(row)
+        if pair_ticker:
+            if runs[-1]:
+                runs.append([])
+            current_ticker = pair_ticker
             current_isin = ''
             continue
 
         # Обработка секции облигаций — тикер и ISIN могут быть в одной строке
-        if any(isinstance(cell, str) and 'isin' in cell.lower() for cell in row):
+        if is_isin_row(row):
+            if runs[-1]:
+                runs.append([])
             for i, cell in enumerate(row):
                 cell_str = str(cell).strip().upper()
                 if cell_str.startswith('ISIN:'):
                     current_isin = cell_str.replace('ISIN:', '').strip()
-                elif re.match(r'^RU\d{9}$', cell_str):
+                elif is_ru_ticker(cell_str):
                     current_ticker = cell_str
             continue
 
-        # Определение типа секции
-        for section, keywords in SECTION_KEYWORDS.items():
-            if any(keyword in str(cell).lower() for cell in row for keyword in keywords):
-                current_section = section
-                col_idx = {}
-                break
+        # Начало подраздела (акции, облигации, валюта) — по индексу разделов
+        if row_num in section_starts:
+            if runs[-1]:
+                runs.append([])
+            current_section = section_starts[row_num]
+            col_idx = {}
+            if progress is not None:
+                progress.update(f"trades:{current_section}", row_num)
 
         # Обработка строки с валютой (только для currency)
         if current_section == 'currency' and not col_idx:
@@ -190,9 +240,9 @@ def parse_trades(filepath: str) -> List[OperationDTO]:
                         pass
 
         # Заголовок таблицы: build map
-        if current_section and not col_idx and HEADER_VARIATIONS_TRADES.get(current_section):
-            if any(any(v in str(cell).lower() for cell in row) for variants in HEADER_VARIATIONS_TRADES[current_section].values() for v in variants):
-                col_idx = build_trade_col_map(row, current_section)
+        if current_section and not col_idx and header_variations.get(current_section):
+            if any(any(v in str(cell).lower() for cell in row) for variants in header_variations[current_section].values() for v in variants):
+                col_idx = build_trade_col_map(row, current_section, header_variations)
                 continue
 
         # Парсим строки сделок
@@ -205,15 +255,19 @@ def parse_trades(filepath: str) -> List[OperationDTO]:
                     ticker=current_ticker or '',
                     currency_hint=current_currency,
                     col_idx=col_idx,
-                    isin=current_isin or ''
+                    isin=current_isin or '',
+                    pool=pool,
+                    currencies=profile.currencies
                 )
                 if dto.date and dto.operation_type:
-                    result.append(dto)
+                    runs[-1].append(dto)
             except Exception as e:
                 print(f"Ошибка при парсинге строки: {row} — {e}")
             continue
 
-    return result
+    if progress is not None and index.trades:
+        progress.update("trades", index.trades.stop)
+    return [run for run in runs if run]
 
 
 
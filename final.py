@@ -1,24 +1,20 @@
+import heapq
 import json
-import re
+from itertools import chain, pairwise
+from operator import attrgetter
 from datetime import datetime
-from typing import Any, Dict, Generator, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 
 from OperationDTO import OperationDTO
-from constants import (
-    CURRENCY_DICT,
-    OPERATION_TYPE_MAP,
-    SKIP_OPERATIONS,
-    SPECIAL_OPERATION_HANDLERS,
-    VALID_OPERATIONS,
-)
-from fin import parse_trades
+from fin import parse_trade_runs
+from format_profiles import FormatProfile, get_profile, resolve_operation_type
+from patterns import ACCOUNT_DATE_RE, ACCOUNT_ID_RE, find_isin
 
 from utils import (
     parse_date,
     extract_rows,
     build_col_index_map_from_row,
-    HEADER_VARIATIONS_FIN_OPS,
     is_nonzero,
 )
 
@@ -26,8 +22,7 @@ logger = logging.getLogger(__name__)
 
 
 def extract_isin(comment: str) -> Optional[str]:
-    match = re.search(r'\b[A-Z]{2}[A-Z0-9]{10}\b', comment)
-    return match.group(0) if match else ""
+    return find_isin(comment)
 
 def safe_float(value: Any) -> float:
     if value is None:
@@ -37,89 +32,30 @@ def safe_float(value: Any) -> float:
     except (ValueError, TypeError):
         return 0.0
 
-def detect_operation_type(op: str, income: str, expense: str) -> str:
-    if not isinstance(op, str):
-        return "other"
-    if "Покупка" in op:
-        return "buy"
-    if "Продажа" in op:
-        return "sell"
-    if op in SPECIAL_OPERATION_HANDLERS:
-        return SPECIAL_OPERATION_HANDLERS[op](income, expense)
-    return OPERATION_TYPE_MAP.get(op, "other")
-
-
-def get_cell(row: List[Any], index: int) -> Any:
-    if not isinstance(row, list):
-        return ""
-    if not isinstance(index, int) or index < 0 or index >= len(row):
-        return ""
-    return row[index]
-
-
-def process_operation_row(
-    data: List[Any],
-    col_idx: Dict[str, int],
-    current_currency: str,
-    ticker: str,
-    operation_id: str
-) -> Optional[OperationDTO]:
+def detect_operation_type(
+    op: str,
+    income: str,
+    expense: str,
+    profile: Optional[FormatProfile] = None
+) -> str:
     """
-    data        — список ячеек строки, начиная со второго столбца Excel
-    col_idx     — {'date': 0, 'operation': 1, 'income': 2, 'expense': 3, 'comment': 4, ...}
-    current_currency — валюта из заголовка (например, 'USD', 'RUB')
+    Тип операции по правилам профиля формата (profile.operation_rules).
+    Пропускаемые и неизвестные операции — покупка/продажа по тексту или "other".
     """
-
-    # 1) операция
-    op_raw = str(data[col_idx["operation"]]).strip()
-    if not op_raw or op_raw in SKIP_OPERATIONS:
-        return None
-    if op_raw not in VALID_OPERATIONS:
-        # можно логировать или собирать в unknown_operations
-        return None
-
-    # 2) дата
-    raw_date = data[col_idx["date"]]
-    date = parse_date(raw_date)
-    if not date:
-        return None
-
-    # 3) суммы
-    income  = str(data[col_idx["income"]]).strip()  if "income"  in col_idx else ""
-    expense = str(data[col_idx["expense"]]).strip() if "expense" in col_idx else ""
-    payment = income if is_nonzero(income) else expense
-    payment = safe_float(payment)
-
-    # 4) комментарий + ISIN
-    comment = str(data[col_idx["comment"]]).strip() if "comment" in col_idx else ""
-    isin_val = extract_isin(comment)
-
-    # 5) тип операции и валюта
-    op_type = detect_operation_type(op_raw, income, expense)
-    currency = CURRENCY_DICT.get(current_currency, current_currency)
-
-    # 6) собираем DTO
-    return OperationDTO(
-        date=date,
-        operation_type=op_type,
-        payment_sum=payment,
-        currency=currency,
-        ticker=ticker,
-        isin=isin_val,
-        price=0.0,
-        quantity=0,
-        aci=0.0,
-        comment=comment,
-        operation_id=operation_id,
-    )
+    if not isinstance(op, str):
+        return "other"
+    rule = (profile or get_profile()).operation_rules.get(op)
+    if rule is None or rule.skip:
+        return resolve_operation_type(op, {})[0]
+    return rule.income_type if is_nonzero(income) else rule.expense_type
 
 
 def parse_header_data(row_str: str, header_data: Dict[str, Optional[str]]) -> None:
     if "Генеральное соглашение:" in row_str:
-        match = re.search(r"Генеральное соглашение:\s*(\d+)", row_str)
+        match = ACCOUNT_ID_RE.search(row_str)
         if match:
             header_data["account_id"] = match.group(1)
-        date_match = re.search(r"от\s+(\d{2}\.\d{2}\.\d{4})", row_str)
+        date_match = ACCOUNT_DATE_RE.search(row_str)
         if date_match:
             header_data["account_date_start"] = parse_date(date_match.group(1))
 
@@ -140,27 +76,82 @@ from utils import (
     parse_date,
     extract_rows,
     build_col_index_map_from_row,
-    HEADER_VARIATIONS_FIN_OPS,
     is_nonzero,
 )
-from constants import CURRENCY_DICT, VALID_OPERATIONS, SKIP_OPERATIONS
 from OperationDTO import OperationDTO
 
-from typing import Generator, List, Dict, Optional, Tuple, Any
+from typing import Iterable, Iterator, List, Dict, NamedTuple, Optional, Tuple, Any
 from OperationDTO import OperationDTO
-from constants import CURRENCY_DICT, VALID_OPERATIONS, SKIP_OPERATIONS
+from aggregation import OperationAggregator
+from format_profiles import DEFAULT_PROFILE, FormatProfile, get_profile
+from sections import ParseProgress, SectionIndex, build_section_index, join_row
 from utils import (
     parse_date,
     build_col_index_map_from_row,
-    HEADER_VARIATIONS_FIN_OPS,
     is_nonzero,
     safe_float,
+    StringPool,
 )
-from final import parse_header_data, detect_operation_type, extract_isin
+from final import parse_header_data, extract_isin
+
+class CashColumnPlan(NamedTuple):
+    """
+    План извлечения строки таблицы ДС: индексы колонок в полной строке
+    (со служебным первым столбцом), -1 — колонки нет. Строится один раз на заголовок.
+    """
+    operation: int
+    date: int
+    income: int
+    expense: int
+    comment: int
+
+
+def build_cash_column_plan(col_idx: Dict[str, int]) -> CashColumnPlan:
+    def column(key: str) -> int:
+        return col_idx[key] + 1 if key in col_idx else -1
+
+    return CashColumnPlan(
+        operation=col_idx["operation"] + 1,
+        date=col_idx["date"] + 1,
+        income=column("income"),
+        expense=column("expense"),
+        comment=column("comment"),
+    )
+
 
 def parse_financial_operations(
-    rows: Generator[List[Any], None, None]
+    rows: Iterable[List[Any]],
+    index: Optional[SectionIndex] = None,
+    pool: Optional[StringPool] = None,
+    profile: Optional[FormatProfile] = None,
 ) -> Tuple[Dict[str, Optional[str]], List[OperationDTO]]:
+    header_data, runs = parse_financial_operation_runs(rows, index, pool, profile)
+    return header_data, list(chain.from_iterable(runs))
+
+
+def parse_financial_operation_runs(
+    rows: Iterable[List[Any]],
+    index: Optional[SectionIndex] = None,
+    pool: Optional[StringPool] = None,
+    profile: Optional[FormatProfile] = None,
+    progress: Optional[ParseProgress] = None,
+) -> Tuple[Dict[str, Optional[str]], List[List[OperationDTO]]]:
+    """
+    Разбор шапки отчета и таблицы движения денежных средств.
+    Обходятся только диапазоны строк из индекса разделов: метаданные шапки
+    и блоки валют таблицы; раздел сделок и всё, что после него, не читается.
+    Операции возвращаются сериями — по одной на блок валюты в порядке отчета.
+    Тип операции определяется одним обращением к таблице правил профиля формата.
+    """
+    profile = profile or get_profile()
+    operation_rules = profile.operation_rules
+    if not isinstance(rows, list):
+        rows = list(rows)
+    if index is None:
+        index = build_section_index(rows, profile)
+    if pool is None:
+        pool = StringPool()
+
     header_data: Dict[str, Optional[str]] = {
         "account_id": None,
         "account_date_start": None,
@@ -168,101 +159,139 @@ def parse_financial_operations(
         "date_end": None,
         "unknown_operations": []
     }
-    operations: List[OperationDTO] = []
-    current_currency: Optional[str] = None
-    parsing: bool = False
-    col_idx: Dict[str, int] = {}
-
-    for row in rows:
-        logger.debug(f"row: {row}")
-        row_str = " ".join(str(c).strip() for c in row if c).strip()
-        if row_str in CURRENCY_DICT:
-            current_currency = CURRENCY_DICT[row_str]
-            continue
-
-        # 2) Ищем строку-заголовок таблицы
-        if not parsing and all(k in row_str.lower() for k in ("дата", "операция", "сумма")):
-            # Отсекаем первый служебный столбец
-            header_cells = row[1:]
-            col_idx = build_col_index_map_from_row(header_cells, HEADER_VARIATIONS_FIN_OPS)
-            parsing = True
-            continue
-
-        # Собираем метаданные до начала таблицы
-        if not parsing:
-            parse_header_data(row_str, header_data)
-            continue
-
-        # Ждём, пока не построится карта колонок
-        if not col_idx:
-            continue
-
-        # 3) Разбираем каждую строку таблицы
-        data: List[Any] = row[1:]  # смещаемся, чтобы индексы col_idx совпадали
-        op_raw = str(data[col_idx["operation"]]).strip()
-        if not op_raw or op_raw in SKIP_OPERATIONS:
-            continue
-        if op_raw not in VALID_OPERATIONS:
-            header_data["unknown_operations"].append(op_raw)
-            continue
-
-        # Дата
-        raw_date = data[col_idx["date"]]
-        date = parse_date(raw_date)
-        if not date:
-            continue
-
-        # Сумма
-        income  = str(data[col_idx["income"]]).strip()  if "income"  in col_idx else ""
-        expense = str(data[col_idx["expense"]]).strip() if "expense" in col_idx else ""
-        payment = safe_float(income if is_nonzero(income) else expense)
-
-        # Комментарий и ISIN
-        comment  = str(data[col_idx["comment"]]).strip() if "comment" in col_idx else ""
-        isin_val = extract_isin(comment)
-
-        # Тип операции и валюта
-        op_type  = detect_operation_type(op_raw, income, expense)
-        currency = current_currency or "RUB"
-
-        operations.append(OperationDTO(
-            date=date,
-            operation_type=op_type,
-            payment_sum=payment,
-            currency=currency,
-            isin=isin_val,
-            comment=comment,
-            operation_id="",
-        ))
-
-    return header_data, operations
-
-
-def parse_full_statement(file_path: str) -> Dict[str, Any]:
+    runs: List[List[OperationDTO]] = []
+
+    # Собираем метаданные до начала таблицы
+    for row_num in index.header:
+        parse_header_data(join_row(rows[row_num]), header_data)
+
+    if index.cash_header_row is None:
+        return header_data, runs
+
+    # Отсекаем первый служебный столбец
+    header_cells = rows[index.cash_header_row][1:]
+    col_idx: Dict[str, int] = build_col_index_map_from_row(header_cells, profile.header_variations_fin_ops)
+    if not col_idx:
+        return header_data, runs
+    op_i, date_i, income_i, expense_i, comment_i = build_cash_column_plan(col_idx)
+
+    for current_currency, block in index.currency_blocks:
+        currency = pool.intern(current_currency or "RUB")
+        operations: List[OperationDTO] = []
+        runs.append(operations)
+        if progress is not None:
+            progress.update(f"cash:{currency}", block.start)
+        for row_num in block:
+            row = rows[row_num]
+            logger.debug("row: %s", row)
+            op_raw = str(row[op_i]).strip()
+            rule = operation_rules.get(op_raw)
+            if rule is None:
+                header_data["unknown_operations"].append(op_raw)
+                continue
+            if rule.skip:
+                continue
+
+            # Дата
+            date = parse_date(row[date_i])
+            if not date:
+                continue
+
+            # Сумма
+            income  = str(row[income_i]).strip()  if income_i >= 0 else ""
+            expense = str(row[expense_i]).strip() if expense_i >= 0 else ""
+            has_income = is_nonzero(income)
+            payment = safe_float(income if has_income else expense)
+
+            # Комментарий и ISIN
+            comment  = pool.intern(str(row[comment_i]).strip()) if comment_i >= 0 else ""
+            isin_val = pool.intern(extract_isin(comment))
+
+            # Тип операции
+            op_type  = pool.intern(rule.income_type if has_income else rule.expense_type)
+
+            operations.append(OperationDTO(
+                date=date,
+                operation_type=op_type,
+                payment_sum=payment,
+                currency=currency,
+                isin=isin_val,
+                comment=comment,
+                operation_id="",
+            ))
+
+    return header_data, runs
+
+
+def merge_operation_runs(runs: List[List[OperationDTO]]) -> Iterator[OperationDTO]:
+    """
+    Слияние серий операций в один поток по времени операции.
+    Серии внутри отчета почти упорядочены, поэтому каждая досортировывается
+    только при необходимости. Операции без даты идут первыми, при равном времени
+    сохраняется порядок серий — как при стабильной сортировке общего списка.
+    """
+    sort_key = attrgetter("_sort_ts")
+    for run in runs:
+        if any(a._sort_ts > b._sort_ts for a, b in pairwise(run)):
+            run.sort(key=sort_key)
+    return heapq.merge(*runs, key=sort_key)
+
+
+def parse_full_statement(
+    file_path: str,
+    statement_format: str = DEFAULT_PROFILE,
+    aggregation_period: Optional[str] = None,
+    include_operations: bool = True,
+    progress: Optional[ParseProgress] = None,
+) -> Dict[str, Any]:
+    """
+    Полный разбор отчета. Если задан aggregation_period (day, month, year, all),
+    итоги по операциям считаются в том же проходе по потоку операций и
+    возвращаются в "aggregates"; список операций можно не возвращать.
+    Ход разбора (раздел, число строк) отражается в progress, если он передан.
+    """
+    aggregator = OperationAggregator(aggregation_period) if aggregation_period else None
+
+    if progress is None:
+        progress = ParseProgress()
     try:
-        rows = list(extract_rows(file_path))
+        rows = []
+        progress.update("reading", 0)
+        for row in extract_rows(file_path):
+            rows.append(row)
+            progress.rows_processed += 1
     except Exception as e:
         raise RuntimeError(f"Ошибка при чтении файла {file_path}: {e}")
 
     if not rows:
         raise ValueError(f"Файл {file_path} пуст или не содержит данных.")
 
-    header_data, financial_operations = parse_financial_operations(iter(rows))
-    trade_operations = parse_trades(file_path)
-    operations = financial_operations + trade_operations
-
-    operations.sort(key=lambda op: (op._sort_key is None, op._sort_key))
-
-    operations_dict = [
-        {k: v for k, v in op.__dict__.items() if not k.startswith("_")}
-        for op in operations
-    ]
-
-    return {
+    progress.rows_total = len(rows)
+    progress.update("index", 0)
+    profile = get_profile(statement_format)
+    index = build_section_index(rows, profile)
+    pool = StringPool()
+    header_data, financial_runs = parse_financial_operation_runs(rows, index, pool, profile, progress)
+    trade_runs = parse_trade_runs(rows=rows, index=index, pool=pool, profile=profile, progress=progress)
+    progress.update("merge", progress.rows_total)
+    operations = merge_operation_runs(financial_runs + trade_runs)
+
+    operations_dict = []
+    for op in operations:
+        if aggregator is not None:
+            aggregator.add(op)
+        if include_operations:
+            operations_dict.append({k: v for k, v in op.__dict__.items() if not k.startswith("_")})
+
+    result = {
         "account_id": header_data.get("account_id"),
         "account_date_start": header_data.get("account_date_start"),
         "date_start": header_data.get("date_start"),
         "date_end": header_data.get("date_end"),
-        "operations": operations_dict,
     }
+    if include_operations:
+        result["operations"] = operations_dict
+    if aggregator is not None:
+        result["aggregates"] = aggregator.result()
+    return result
 
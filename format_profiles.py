@@ -0,0 +1,107 @@
+import json
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+#  Каталог с описаниями форматов отчетов (*.json), можно переопределить переменной окружения
+FORMATS_DIR = Path(os.environ.get("STATEMENT_FORMATS_DIR", Path(__file__).parent / "formats"))
+DEFAULT_PROFILE = "bcs"
+
+
+@dataclass(frozen=True)
+class OperationRule:
+    """
+    Действие для строки операции: пропустить или разобрать с типом,
+    зависящим от того, есть ли сумма зачисления.
+    """
+    skip: bool = False
+    income_type: str = "other"
+    expense_type: str = "other"
+
+
+SKIP_RULE = OperationRule(skip=True)
+
+
+@dataclass(frozen=True)
+class FormatProfile:
+    """Скомпилированный профиль формата отчета брокера."""
+    name: str
+    description: str
+    operation_rules: Dict[str, OperationRule]
+    currencies: Dict[str, str]
+    cash_table_header: Tuple[str, ...]
+    header_variations_fin_ops: Dict[str, list]
+    trades_marker: str
+    trades_section_number: str
+    section_keywords: Dict[str, list]
+    header_variations_trades: Dict[str, Dict[str, list]]
+
+
+def list_profiles() -> List[str]:
+    return sorted(path.stem for path in FORMATS_DIR.glob("*.json"))
+
+
+def load_profile_data(name: str) -> Dict[str, Any]:
+    path = FORMATS_DIR / f"{name}.json"
+    if not path.is_file():
+        raise ValueError(f"Неизвестный формат отчета: {name}")
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def resolve_operation_type(op: str, data: Dict[str, Any]) -> Tuple[str, str]:
+    """
+    Тип операции для зачисления и для списания — единственное место, где
+    задан порядок проверок: покупка/продажа по тексту, типы, зависящие от
+    направления суммы, затем типы по названию. С пустым data дает
+    покупку/продажу или "other" (так final.detect_operation_type типизирует
+    операции вне таблицы правил).
+    """
+    if "Покупка" in op:
+        return "buy", "buy"
+    if "Продажа" in op:
+        return "sell", "sell"
+    context_types = data.get("context_operation_types", {})
+    if op in context_types:
+        return context_types[op]["income"], context_types[op]["expense"]
+    op_type = data.get("operation_types", {}).get(op, "other")
+    return op_type, op_type
+
+
+def compile_profile(data: Dict[str, Any]) -> FormatProfile:
+    """
+    Сборка таблицы операций: сырой текст операции -> OperationRule.
+    Операции, которых нет в таблице, считаются неизвестными.
+    """
+    rules: Dict[str, OperationRule] = {}
+    for op in data.get("valid_operations", []):
+        income_type, expense_type = resolve_operation_type(op, data)
+        rules[op] = OperationRule(income_type=income_type, expense_type=expense_type)
+    for op in data.get("skip_operations", []):
+        rules[op] = SKIP_RULE
+    rules[""] = SKIP_RULE
+
+    trades_marker = data.get("trades_marker", "").lower()
+    number_match = re.match(r'^(\d+(?:\.\d+)*)\.', trades_marker)
+
+    return FormatProfile(
+        name=data["name"],
+        description=data.get("description", ""),
+        operation_rules=rules,
+        currencies=dict(data.get("currencies", {})),
+        cash_table_header=tuple(k.lower() for k in data.get("cash_table_header", [])),
+        header_variations_fin_ops=data.get("header_variations_fin_ops", {}),
+        trades_marker=trades_marker,
+        trades_section_number=number_match.group(1) if number_match else "",
+        section_keywords=data.get("section_keywords", {}),
+        header_variations_trades=data.get("header_variations_trades", {}),
+    )
+
+
+@lru_cache(maxsize=None)
+def get_profile(name: Optional[str] = None) -> FormatProfile:
+    """Профиль формата по имени; компилируется один раз и кэшируется."""
+    return compile_profile(load_profile_data(name or DEFAULT_PROFILE))
@@ -0,0 +1,428 @@
+import glob
+import gzip
+import json
+import logging
+import os
+import re
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from sections import ParseProgress
+
+logger = logging.getLogger(__name__)
+
+#  Настройки фоновых задач разбора (переопределяются переменными окружения).
+#  Каталог задач общий для всех воркеров uvicorn: статус и результат задачи
+#  можно запросить у любого процесса, а не только у принявшего загрузку.
+JOB_DIR = os.environ.get("PARSING_JOB_DIR", os.path.join(tempfile.gettempdir(), "parsing-jobs"))
+JOB_WORKERS = int(os.environ.get("PARSING_JOB_WORKERS", "2"))
+JOB_MAX_JOBS = int(os.environ.get("PARSING_JOB_MAX_JOBS", "100"))
+JOB_TTL_SECONDS = int(os.environ.get("PARSING_JOB_TTL_SECONDS", "3600"))
+#  Незавершенная задача старше этого срока считается зависшей и помечается упавшей
+JOB_MAX_AGE_SECONDS = int(os.environ.get("PARSING_JOB_MAX_AGE_SECONDS", "3600"))
+
+#  Не чаще чем раз в столько секунд ход разбора сбрасывается в файл статуса
+#  и каталог задач просматривается на предмет истекших задач
+PROGRESS_SAVE_INTERVAL = 0.5
+EXPIRE_INTERVAL = 1.0
+#  Каждый JobManager раз в OWNER_HEARTBEAT_INTERVAL обновляет файл <owner>.owner;
+#  владелец, не обновлявший его дольше OWNER_TIMEOUT, считается завершившимся
+OWNER_HEARTBEAT_INTERVAL = 5.0
+OWNER_TIMEOUT = 30.0
+
+STATUS_SUFFIX = ".status.json"
+RESULT_SUFFIX = ".json.gz"
+OWNER_SUFFIX = ".owner"
+
+#  Расширения загрузок (по сигнатуре файла) и допустимые идентификаторы задач:
+#  пути к файлам задачи строятся только из них, пути из файлов статуса не читаются
+JOB_EXTENSIONS = ("xls", "xlsx")
+JOB_ID_RE = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class JobStoreFullError(Exception):
+    """Хранилище задач заполнено незавершенными задачами."""
+
+
+@dataclass
+class JobProgress(ParseProgress):
+    """Ход разбора задачи: при смене раздела вызывает on_update, чтобы сохранить статус."""
+    on_update: Optional[Callable[[], None]] = field(default=None, repr=False, compare=False)
+
+    def update(self, section: str, rows_processed: int) -> None:
+        super().update(section, rows_processed)
+        if self.on_update is not None:
+            self.on_update()
+
+
+@dataclass
+class Job:
+    job_id: str
+    filename: str
+    extension: str
+    status: str = JOB_QUEUED
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    pid: int = field(default_factory=os.getpid)
+    owner: str = ""
+    progress: ParseProgress = field(default_factory=ParseProgress)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "status": self.status,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "section": self.progress.section,
+            "rows_processed": self.progress.rows_processed,
+            "rows_total": self.progress.rows_total,
+            "error": self.error,
+        }
+
+    def to_record(self) -> Dict[str, Any]:
+        """Содержимое файла статуса: публичные поля, расширение загрузки и владелец задачи."""
+        record = self.to_dict()
+        record.update(extension=self.extension, pid=self.pid, owner=self.owner)
+        return record
+
+    @classmethod
+    def from_record(cls, job_id: str, record: Dict[str, Any]) -> "Job":
+        """Задача из файла статуса; идентификатор берется из имени файла, а не из записи."""
+        if record["extension"] not in JOB_EXTENSIONS:
+            raise ValueError(f"Недопустимое расширение загрузки: {record['extension']}")
+        return cls(
+            job_id=job_id,
+            filename=record["filename"],
+            extension=record["extension"],
+            status=record["status"],
+            created_at=record["created_at"],
+            finished_at=record["finished_at"],
+            error=record["error"],
+            pid=record["pid"],
+            owner=record["owner"],
+            progress=ParseProgress(record["section"], record["rows_processed"], record["rows_total"]),
+        )
+
+
+def prepare_work_dir(path: str) -> None:
+    """
+    Создает каталог задач с правами 0o700. Каталог, созданный другим пользователем,
+    символическая ссылка или каталог, доступный на запись группе/остальным,
+    не используются: кто может писать в каталог, тот управляет файлами задач.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f"Каталог задач {path} не является каталогом")
+    if hasattr(os, "getuid") and info.st_uid != os.getuid():
+        raise PermissionError(f"Каталог задач {path} принадлежит другому пользователю")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"Каталог задач {path} доступен на запись другим пользователям")
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobManager:
+    """
+    Фоновые задачи разбора: пул потоков с ограничением параллельности и
+    хранилище задач в общем каталоге с истечением срока хранения результатов.
+    На каждую задачу в каталоге приходится файл статуса (<id>.status.json),
+    загруженный отчет и результат в сжатом виде (<id>.json.gz), поэтому
+    при запуске с несколькими воркерами uvicorn опрос задачи может попасть
+    в любой процесс. Файл статуса перезаписывается атомарно.
+    Пути к файлам задачи строятся из work_dir, идентификатора и расширения
+    (source_path/result_path), в файлах статуса путей нет.
+    Задачи, которые выполняет этот процесс, до завершения держатся в памяти,
+    чтобы ход разбора отдавался без задержки на запись в файл.
+    Незавершенная задача чужого владельца помечается упавшей, если владелец
+    перестал обновлять свой файл <owner>.owner (идентификатор владельца
+    случайный, так что перезапуск с тем же PID его не воскрешает), а любая
+    незавершенная задача — если она старше max_age_seconds.
+    Ограничение числа задач общее для каталога и соблюдается приблизительно:
+    одновременные отправки в разные процессы могут ненадолго его превысить.
+    """
+
+    def __init__(
+        self,
+        work_dir: str = JOB_DIR,
+        workers: int = JOB_WORKERS,
+        max_jobs: int = JOB_MAX_JOBS,
+        ttl_seconds: float = JOB_TTL_SECONDS,
+        max_age_seconds: float = JOB_MAX_AGE_SECONDS,
+    ) -> None:
+        self.work_dir = work_dir
+        self.max_jobs = max_jobs
+        self.ttl_seconds = ttl_seconds
+        self.max_age_seconds = max_age_seconds
+        self.owner_id = uuid.uuid4().hex
+        prepare_work_dir(self.work_dir)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="parsing-job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._saved_at: Dict[str, float] = {}
+        self._expired_at = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._touch_owner()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name="parsing-job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def new_job_path(self, job_id: str, suffix: str) -> str:
+        return os.path.join(self.work_dir, f"{job_id}{suffix}")
+
+    def source_path(self, job: Job) -> str:
+        return self.new_job_path(job.job_id, f".{job.extension}")
+
+    def result_path(self, job_id: str) -> str:
+        return self.new_job_path(job_id, RESULT_SUFFIX)
+
+    def submit(
+        self,
+        job_id: str,
+        filename: str,
+        extension: str,
+        task: Callable[[str, ParseProgress], Dict[str, Any]],
+    ) -> Job:
+        """
+        Регистрирует задачу и ставит ее в очередь пула. Загрузка уже лежит
+        в new_job_path(job_id, "." + extension); task(путь, progress)
+        возвращает результат разбора.
+        """
+        if not JOB_ID_RE.match(job_id) or extension not in JOB_EXTENSIONS:
+            raise ValueError(f"Недопустимая задача: {job_id}.{extension}")
+        job = Job(job_id=job_id, filename=filename, extension=extension, owner=self.owner_id)
+        job.progress = JobProgress(on_update=lambda: self._save_progress(job))
+        with self._lock:
+            self._expire(force=True)
+            self._evict_for_new_job()
+            if len(self._load_all()) >= self.max_jobs:
+                raise JobStoreFullError(f"Превышено число задач в обработке: {self.max_jobs}")
+            self._jobs[job_id] = job
+            self._save(job)
+        self._executor.submit(self._run, job, task)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job
+            if not JOB_ID_RE.match(job_id):
+                return None
+            job = self._load(job_id)
+            return self._check(job, time.time()) if job is not None else None
+
+    def _run(self, job: Job, task: Callable[[str, ParseProgress], Dict[str, Any]]) -> None:
+        with self._lock:
+            if job.finished:
+                self._remove_file(self.source_path(job))
+                return
+            job.status = JOB_RUNNING
+            self._save(job)
+        error: Optional[str] = None
+        try:
+            result = task(self.source_path(job), job.progress)
+            with gzip.open(self.result_path(job.job_id), "wt", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+        except Exception as e:
+            logger.exception(f"Ошибка в задаче {job.job_id}: {e}")
+            error = str(e)
+            self._remove_file(self.result_path(job.job_id))
+        finally:
+            self._remove_file(self.source_path(job))
+        self._finish(job, error)
+
+    def _finish(self, job: Job, error: Optional[str]) -> None:
+        """
+        Завершение задачи: поля результата заполняются до смены статуса и под блокировкой.
+        Дальше задача отдается из файла статуса, как и всем остальным воркерам.
+        Если задачу уже пометили упавшей по сроку, результат отбрасывается.
+        """
+        with self._lock:
+            if job.finished:
+                self._remove_file(self.result_path(job.job_id))
+                return
+            job.finished_at = time.time()
+            job.error = error
+            job.status = JOB_FAILED if error is not None else JOB_DONE
+            self._save(job)
+            self._jobs.pop(job.job_id, None)
+            self._saved_at.pop(job.job_id, None)
+
+    def _fail(self, job: Job, error: str) -> None:
+        """Помечает незавершенную задачу упавшей и удаляет загруженный файл."""
+        job.finished_at = time.time()
+        job.error = error
+        job.status = JOB_FAILED
+        self._save(job)
+        self._jobs.pop(job.job_id, None)
+        self._saved_at.pop(job.job_id, None)
+        self._remove_file(self.source_path(job))
+
+    def _owner_path(self, owner_id: str) -> str:
+        return os.path.join(self.work_dir, f"{owner_id}{OWNER_SUFFIX}")
+
+    def _touch_owner(self) -> None:
+        path = self._owner_path(self.owner_id)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+
+    def _heartbeat_loop(self) -> None:
+        while not self._stopped.wait(OWNER_HEARTBEAT_INTERVAL):
+            try:
+                self._touch_owner()
+            except OSError as e:
+                logger.warning(f"Не удалось обновить файл владельца задач: {e}")
+
+    def _is_owner_alive(self, job: Job, now: float) -> bool:
+        if job.owner == self.owner_id:
+            return True
+        if not job.owner or not is_process_alive(job.pid):
+            return False
+        try:
+            return now - os.path.getmtime(self._owner_path(job.owner)) <= OWNER_TIMEOUT
+        except OSError:
+            return False
+
+    def _save_progress(self, job: Job) -> None:
+        if time.time() - self._saved_at.get(job.job_id, 0.0) < PROGRESS_SAVE_INTERVAL:
+            return
+        with self._lock:
+            if job.job_id in self._jobs and not job.finished:
+                self._save(job)
+
+    def _save(self, job: Job) -> None:
+        path = self.new_job_path(job.job_id, STATUS_SUFFIX)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job.to_record(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._saved_at[job.job_id] = time.time()
+
+    def _load(self, job_id: str) -> Optional[Job]:
+        try:
+            with open(self.new_job_path(job_id, STATUS_SUFFIX), encoding="utf-8") as f:
+                return Job.from_record(job_id, json.load(f))
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None
+
+    def _load_all(self) -> List[Job]:
+        """Все задачи каталога от старых к новым; задачи этого процесса берутся из памяти."""
+        jobs = []
+        for path in glob.glob(os.path.join(self.work_dir, f"*{STATUS_SUFFIX}")):
+            job_id = os.path.basename(path)[:-len(STATUS_SUFFIX)]
+            if not JOB_ID_RE.match(job_id):
+                continue
+            job = self._jobs.get(job_id) or self._load(job_id)
+            if job is not None:
+                jobs.append(job)
+        jobs.sort(key=lambda job: job.created_at)
+        return jobs
+
+    def _is_expired(self, job: Job, now: float) -> bool:
+        return job.finished and job.finished_at is not None and now - job.finished_at > self.ttl_seconds
+
+    def _check(self, job: Job, now: float) -> Optional[Job]:
+        """
+        Применяет к задаче сроки хранения и выполнения: None — задача удалена,
+        иначе задача (возможно, уже помеченная упавшей).
+        """
+        if self._is_expired(job, now):
+            self._drop(job)
+            return None
+        if job.finished:
+            return job
+        if job.job_id not in self._jobs and not self._is_owner_alive(job, now):
+            self._fail(job, "Процесс, выполнявший задачу, завершился")
+        elif now - job.created_at > self.max_age_seconds:
+            self._fail(job, "Превышено время выполнения задачи")
+        return job
+
+    def _expire(self, force: bool = False) -> None:
+        """
+        Удаляет завершенные задачи, срок хранения которых истек, и помечает
+        упавшими незавершенные задачи завершившихся владельцев и зависшие задачи.
+        Без force каталог просматривается не чаще раза в EXPIRE_INTERVAL.
+        """
+        now = time.time()
+        if not force and now - self._expired_at < EXPIRE_INTERVAL:
+            return
+        self._expired_at = now
+        for job in self._load_all():
+            self._check(job, now)
+        for path in glob.glob(os.path.join(self.work_dir, f"*{OWNER_SUFFIX}")):
+            try:
+                if now - os.path.getmtime(path) > OWNER_TIMEOUT:
+                    os.unlink(path)
+            except OSError:
+                pass
+
+    def _evict_for_new_job(self) -> None:
+        """При заполненном хранилище освобождает место, удаляя самые старые завершенные задачи."""
+        jobs = self._load_all()
+        finished = [job for job in jobs if job.finished and job.finished_at is not None]
+        count = len(jobs)
+        while count >= self.max_jobs and finished:
+            self._drop(finished.pop(0))
+            count -= 1
+
+    def _drop(self, job: Job) -> None:
+        self._jobs.pop(job.job_id, None)
+        self._saved_at.pop(job.job_id, None)
+        self._remove_file(self.new_job_path(job.job_id, STATUS_SUFFIX))
+        self._remove_file(self.result_path(job.job_id))
+        self._remove_file(self.source_path(job))
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Не удалось удалить файл задачи {path}: {e}")
+
+    def shutdown(self) -> None:
+        """
+        Останавливает пул. Задачи, которые еще не начались, помечаются упавшими
+        (пул их отменяет); выполняющиеся после остановки процесса другие воркеры
+        пометят упавшими по файлу владельца. Каталог задач общий и не удаляется.
+        """
+        with self._lock:
+            for job in list(self._jobs.values()):
+                if job.status == JOB_QUEUED:
+                    self._fail(job, "Сервис остановлен до начала задачи")
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._stopped.set()
+        self._remove_file(self._owner_path(self.owner_id))
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
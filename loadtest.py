@@ -0,0 +1,326 @@
+"""
+Нагрузочное тестирование сервиса парсинга.
+
+Скрипт генерирует синтетические отчеты разного размера, поднимает локальный
+uvicorn с main:app для каждой конфигурации воркеров, отправляет запросы в
+/parse-financial-operations с заданной параллельностью и печатает пропускную
+способность, перцентили задержки, долю ошибок и пиковый RSS сервера.
+Результаты сохраняются в JSON для сравнения запусков.
+
+Пример:
+    python loadtest.py --workers 1 2 --concurrency 4 --requests 60 --mix small=6,medium=3,large=1
+    python loadtest.py --compare loadtest_results/*.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import openpyxl
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+ENDPOINT = "/parse-financial-operations"
+
+#  Размеры синтетических отчетов: (строк движения ДС, строк сделок)
+STATEMENT_SIZES = {
+    "small": (200, 100),
+    "medium": (2000, 1000),
+    "large": (20000, 10000),
+}
+
+CASH_OPERATIONS = [
+    "Дивиденды", "Погашение купона", "Приход ДС", "Вывод ДС", "НДФЛ",
+    "Вознаграждение компании", "Покупка/Продажа", 'Проценты по займам "овернайт"',
+]
+ISINS = ["RU000A0JX0J2", "RU0009029540", "RU000A101QE0", "RU000A0ZYG52"]
+
+
+def build_statement(path: str, cash_rows: int, trade_rows: int, seed: int = 0) -> None:
+    """Синтетический отчет в формате БКС: шапка, движение ДС, раздел сделок с акциями."""
+    rnd = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.append([None, "Генеральное соглашение: 100000 от 01.02.2020"])
+    ws.append([None, "Период: с 01.01.2023 по 31.12.2023"])
+    ws.append([None, "RUB"])
+    ws.append([None, "Дата", "Операция", "Сумма зачисления", "Сумма списания", "Примечание"])
+    day = datetime(2023, 1, 1)
+    for _ in range(cash_rows):
+        day += timedelta(minutes=rnd.randint(0, 600))
+        income = round(rnd.random() * 1000, 2) if rnd.random() < 0.5 else 0
+        expense = 0 if income else round(rnd.random() * 500, 2)
+        ws.append([None, day, rnd.choice(CASH_OPERATIONS), income, expense, f"Выплата {rnd.choice(ISINS)}"])
+
+    ws.append([None, "2.1. Сделки:"])
+    ws.append([None, "Акция"])
+    ws.append([None, "Номер", "Дата", "Куплено, шт", "Цена", "Сумма платежа", "Продано, шт", "Цена",
+               "Сумма выручки", None, "Валюта цены", "Дата соверш.", "Время соверш.",
+               None, None, None, None, "Примечание"])
+    ws.append([None, rnd.choice(ISINS), "ISIN: " + rnd.choice(ISINS)])
+    for i in range(trade_rows):
+        buy = rnd.random() < 0.5
+        qty = rnd.randint(1, 100)
+        ws.append([None, i + 1, None, qty if buy else 0, 100.5, qty * 100.5 if buy else 0,
+                   0 if buy else qty, 101.0, 0 if buy else qty * 101.0, None, "RUB",
+                   day + timedelta(hours=i), "10:00:00", None, None, None, None, "БММ"])
+    wb.save(path)
+
+
+def encode_multipart(field: str, filename: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    head = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    return head + content + f"\r\n--{boundary}--\r\n".encode(), f"multipart/form-data; boundary={boundary}"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, workers: int, log_path: str) -> subprocess.Popen:
+    """Запускает uvicorn с main:app и ждет ответа /health."""
+    with open(log_path, "ab") as log:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=PROJECT_DIR, stdout=log, stderr=log,
+        )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Сервер завершился при старте, см. {log_path}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1):
+                return proc
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"Сервер не ответил на /health за 60 секунд, см. {log_path}")
+
+
+def process_tree_rss(pid: int) -> int:
+    """RSS процесса и всех его потомков в байтах (Linux /proc), 0 если недоступно."""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (FileNotFoundError, ProcessLookupError, PermissionError):
+            continue
+    return total
+
+
+class RssSampler(threading.Thread):
+    """Периодически снимает RSS дерева процессов сервера, хранит пиковое значение."""
+
+    def __init__(self, pid: int, interval: float = 0.2) -> None:
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+            self._stop_event.wait(self.interval)
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def percentile(sorted_values: List[float], p: float) -> Optional[float]:
+    if not sorted_values:
+        return None
+    # метод ближайшего ранга
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def send_request(url: str, filename: str, content: bytes, timeout: float) -> Tuple[float, Optional[int], Optional[str]]:
+    body, content_type = encode_multipart("file", filename, content)
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            return time.perf_counter() - start, response.status, None
+    except urllib.error.HTTPError as e:
+        return time.perf_counter() - start, e.code, None
+    except Exception as e:
+        return time.perf_counter() - start, None, type(e).__name__
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights: Dict[str, int] = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in STATEMENT_SIZES:
+            raise ValueError(f"Неизвестный размер отчета: {name}")
+        weights[name] = int(weight or 1)
+    return weights
+
+
+def run_config(
+    workers: int,
+    statements: Dict[str, bytes],
+    weights: Dict[str, int],
+    args: argparse.Namespace,
+    work_dir: str,
+) -> Dict[str, Any]:
+    """Прогон одной конфигурации сервера: запросы с заданной параллельностью и сводка."""
+    port = free_port()
+    server = start_server(port, workers, os.path.join(work_dir, f"server-{workers}.log"))
+    url = f"http://127.0.0.1:{port}{ENDPOINT}"
+    rnd = random.Random(args.seed)
+    plan = rnd.choices(list(weights), weights=list(weights.values()), k=args.requests)
+
+    sampler = RssSampler(server.pid)
+    sampler.start()
+    try:
+        for size in plan[:args.warmup]:
+            send_request(url, f"{size}.xlsx", statements[size], args.timeout)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(
+                lambda size: (size,) + send_request(url, f"{size}.xlsx", statements[size], args.timeout),
+                plan,
+            ))
+        elapsed = time.perf_counter() - started
+    finally:
+        peak_rss = sampler.stop()
+        server.terminate()
+        server.wait(timeout=30)
+
+    return summarize(workers, results, elapsed, peak_rss, args)
+
+
+def summarize(
+    workers: int,
+    results: List[Tuple[str, float, Optional[int], Optional[str]]],
+    elapsed: float,
+    peak_rss: int,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    def latency_stats(latencies: List[float]) -> Dict[str, Optional[float]]:
+        latencies = sorted(latencies)
+        return {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        }
+
+    errors: Dict[str, int] = {}
+    for _, _, status, error in results:
+        if status != 200:
+            key = error or str(status)
+            errors[key] = errors.get(key, 0) + 1
+
+    by_size = {}
+    for size in sorted({r[0] for r in results}):
+        latencies = [r[1] for r in results if r[0] == size and r[2] == 200]
+        by_size[size] = {"requests": sum(1 for r in results if r[0] == size), **latency_stats(latencies)}
+
+    ok_latencies = [r[1] for r in results if r[2] == 200]
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "workers": workers,
+        "concurrency": args.concurrency,
+        "requests": len(results),
+        "mix": args.mix,
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed if elapsed else None,
+        "error_rate": (len(results) - len(ok_latencies)) / len(results) if results else 0.0,
+        "errors": errors,
+        "latency": latency_stats(ok_latencies),
+        "latency_by_size": by_size,
+        "peak_rss_bytes": peak_rss,
+    }
+
+
+def print_summaries(summaries: List[Dict[str, Any]]) -> None:
+    def ms(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f}" if value is not None else "-"
+
+    print(f"{'timestamp':<20} {'workers':>7} {'conc':>5} {'reqs':>5} {'req/s':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'RSS MB':>8}")
+    for s in summaries:
+        latency = s["latency"]
+        print(f"{s['timestamp']:<20} {s['workers']:>7} {s['concurrency']:>5} {s['requests']:>5} "
+              f"{s['throughput']:>7.2f} {ms(latency['p50']):>8} {ms(latency['p95']):>8} {ms(latency['p99']):>8} "
+              f"{s['error_rate']:>7.1%} {s['peak_rss_bytes'] / 2 ** 20:>8.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /parse-financial-operations")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1], help="Число воркеров uvicorn (несколько — сравнение)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Число одновременных запросов")
+    parser.add_argument("--requests", type=int, default=40, help="Запросов на конфигурацию")
+    parser.add_argument("--mix", default="small=6,medium=3,large=1", help="Доли размеров отчетов")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Таймаут запроса, с")
+    parser.add_argument("--warmup", type=int, default=1, help="Прогревочных запросов до замера")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output-dir", default=os.path.join(PROJECT_DIR, "loadtest_results"),
+                        help="Каталог для JSON с результатами")
+    parser.add_argument("--compare", nargs="+", metavar="RESULT_JSON",
+                        help="Только вывести сводку по сохраненным результатам")
+    args = parser.parse_args()
+
+    if args.compare:
+        summaries: List[Dict[str, Any]] = []
+        for path in args.compare:
+            with open(path, encoding="utf-8") as f:
+                summaries.extend(json.load(f)["runs"])
+        print_summaries(summaries)
+        return
+
+    weights = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory(prefix="parsing-loadtest-") as work_dir:
+        statements: Dict[str, bytes] = {}
+        for size in weights:
+            path = os.path.join(work_dir, f"{size}.xlsx")
+            build_statement(path, *STATEMENT_SIZES[size], seed=args.seed)
+            with open(path, "rb") as f:
+                statements[size] = f.read()
+
+        summaries = [run_config(workers, statements, weights, args, work_dir) for workers in args.workers]
+
+    print_summaries(summaries)
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"loadtest-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump({"args": vars(args), "runs": summaries}, f, ensure_ascii=False, indent=2)
+    print(f"Результаты сохранены: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
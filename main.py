@@ -1,17 +1,28 @@
+import gzip
+import hashlib
 import os
 import logging
 import tempfile
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 
 import xlrd
 import openpyxl
 
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Query
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.datastructures import Headers
 from starlette.middleware.cors import CORSMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
+from aggregation import AGGREGATION_PERIODS
 from final import parse_full_statement
+from format_profiles import DEFAULT_PROFILE, get_profile, list_profiles
+from jobs import JOB_DONE, JOB_FAILED, Job, JobManager, JobStoreFullError, new_job_id
+from sections import ParseProgress
 from OperationDTO import OperationDTO
 
 # === Настройка логгирования ===
@@ -23,21 +34,39 @@ logger = logging.getLogger()
 logger.setLevel(logging.DEBUG)
 
 # === Настройки приложения ===
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    job_manager.shutdown()
+
 app = FastAPI(
     title="Финансовый парсер",
     description="API для парсинга отчетов БКС",
-    version="1.0.0"
-)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Разрешаем доступ с любых источников (можно ограничить)
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 ALLOWED_EXTENSIONS = {"xls", "xlsx"}
+RESULT_CHUNK_SIZE = 64 * 1024
+
+# Загрузка файлов: чтение по частям с ограничением размера
+MAX_UPLOAD_SIZE = int(os.environ.get("PARSING_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Запас на заголовки частей multipart и прочие поля формы сверх размера файла
+MULTIPART_OVERHEAD = 64 * 1024
+# Сколько байт начала тела запроса просматривается в поисках сигнатуры файла
+SNIFF_LIMIT = 64 * 1024
+OLE2_SIGNATURE = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+ZIP_SIGNATURE = b"PK\x03\x04"
+
+# Задачи хранятся в общем каталоге (PARSING_JOB_DIR, права 0o700), поэтому сервис можно
+# запускать с несколькими воркерами: uvicorn main:app --workers N
+job_manager = JobManager()
+
+# Профили форматов компилируются один раз при старте и кэшируются между запросами
+STATEMENT_FORMATS = list_profiles()
+for _name in STATEMENT_FORMATS:
+    get_profile(_name)
 
 def validate_file_extension(file: UploadFile) -> str:
     """Проверяет расширение файла и возвращает его, если оно допустимо."""
@@ -49,16 +78,170 @@ def validate_file_extension(file: UploadFile) -> str:
         )
     return extension
 
-async def save_upload_file_tmp(file: UploadFile):
-    temp_dir = tempfile.gettempdir()
-    temp_file_path = os.path.join(temp_dir, file.filename)
+def validate_statement_format(
+    statement_format: str = Query(DEFAULT_PROFILE, description="Формат отчета брокера")
+) -> str:
+    """Проверяет, что для формата отчета есть профиль."""
+    if statement_format not in STATEMENT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Поддерживаются форматы отчетов: {', '.join(STATEMENT_FORMATS)}"
+        )
+    return statement_format
+
+def validate_aggregation_period(
+    aggregate: Optional[str] = Query(None, description="Период агрегации итогов: day, month, year, all")
+) -> Optional[str]:
+    """Проверяет период агрегации, если он задан."""
+    if aggregate is not None and aggregate not in AGGREGATION_PERIODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Поддерживаются периоды агрегации: {', '.join(AGGREGATION_PERIODS)}"
+        )
+    return aggregate
+
+@dataclass
+class SavedUpload:
+    path: str
+    extension: str
+    size: int
+    sha256: str
+
+def sniff_file_format(head: bytes) -> Optional[str]:
+    """Определяет формат Excel по сигнатуре файла: OLE2 — xls, ZIP — xlsx."""
+    if head.startswith(OLE2_SIGNATURE):
+        return "xls"
+    if head.startswith(ZIP_SIGNATURE):
+        return "xlsx"
+    return None
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=413,
+        detail=f"Размер файла превышает {MAX_UPLOAD_SIZE} байт"
+    )
+
+def not_excel_file() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Файл не является документом Excel: {', '.join(ALLOWED_EXTENSIONS)}"
+    )
+
+def sniff_multipart_file(head: bytes) -> Optional[bool]:
+    """
+    Проверяет сигнатуру первого файла в начале multipart-тела запроса.
+    True/False — файл Excel или нет; None — начало файла еще не прочитано.
+    """
+    pos = head.find(b"filename=")
+    if pos < 0:
+        return None
+    start = head.find(b"\r\n\r\n", pos)
+    if start < 0:
+        return None
+    data = head[start + 4:start + 4 + len(OLE2_SIGNATURE)]
+    if len(data) < len(OLE2_SIGNATURE):
+        return None
+    return sniff_file_format(data) is not None
+
+class UploadGuardMiddleware:
+    """
+    Проверки загрузки до разбора формы: Starlette сохраняет тело запроса
+    во временные файлы целиком еще до вызова обработчика.
+    - Content-Length больше max_body_size — 413 без чтения тела;
+    - тело без Content-Length считается по ходу чтения, 413 при превышении;
+    - в multipart-запросе начало файла сверяется с сигнатурами xls/xlsx,
+      и файл не Excel получает 400 по первым блокам тела.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int) -> None:
+        self.app = app
+        self.max_body_size = max_body_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        content_length = headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse(status_code=413, content={"detail": upload_too_large().detail})
+            await response(scope, receive, send)
+            return
+
+        sniffing = headers.get("content-type", "").startswith("multipart/form-data")
+        received = 0
+        head = b""
+
+        async def guarded_receive() -> Message:
+            nonlocal sniffing, received, head
+            message = await receive()
+            if message["type"] != "http.request":
+                return message
+            chunk = message.get("body", b"")
+            received += len(chunk)
+            if received > self.max_body_size:
+                raise upload_too_large()
+            if sniffing:
+                head += chunk
+                is_excel = sniff_multipart_file(head)
+                if is_excel is not None or len(head) > SNIFF_LIMIT:
+                    sniffing = False
+                    head = b""
+                if is_excel is False:
+                    raise not_excel_file()
+            return message
+
+        await self.app(scope, guarded_receive, send)
+
+# Middleware, добавленный позже, оборачивает предыдущий: CORS снаружи,
+# чтобы ответы 413/400 тоже получали CORS-заголовки
+app.add_middleware(UploadGuardMiddleware, max_body_size=MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # Разрешаем доступ с любых источников (можно ограничить)
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+async def save_upload_file_tmp(
+    file: UploadFile,
+    dest_dir: Optional[str] = None,
+    name: Optional[str] = None
+) -> SavedUpload:
+    """
+    Сохраняет загрузку во временный файл по частям, с ограничением размера файла
+    (тело запроса целиком ограничивается раньше, в UploadGuardMiddleware).
+    Формат (и расширение файла для выбора xlrd/openpyxl) определяется по сигнатуре
+    первого блока, хэш SHA-256 считается по ходу чтения.
+    """
+    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    extension = sniff_file_format(chunk)
+    if extension is None:
+        raise not_excel_file()
+
+    temp_file_path = os.path.join(dest_dir or tempfile.gettempdir(), f"{name or uuid.uuid4().hex}.{extension}")
+    digest = hashlib.sha256()
+    size = 0
     try:
         with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(await file.read())
-        return temp_file_path
+            while chunk:
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise upload_too_large()
+                digest.update(chunk)
+                temp_file.write(chunk)
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    except HTTPException:
+        os.unlink(temp_file_path)
+        raise
     except Exception as e:
         logger.error(f"Ошибка при сохранении файла: {e}")
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
         raise HTTPException(status_code=500, detail=f"Ошибка при сохранении файла: {e}")
+    return SavedUpload(path=temp_file_path, extension=extension, size=size, sha256=digest.hexdigest())
 
 def serialize_operations(result: Dict[str, Any]) -> Dict[str, Any]:
     """Преобразует объекты OperationDTO в словари."""
@@ -70,6 +253,47 @@ def serialize_operations(result: Dict[str, Any]) -> Dict[str, Any]:
         ]
     return result
 
+#  Строковые поля операций, которые кодируются словарем
+DICTIONARY_FIELDS = ("operation_type", "currency", "ticker", "isin", "comment")
+
+def dictionary_encode_operations(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Заменяет повторяющиеся строковые поля операций индексами в result["dictionary"].
+    Значение восстанавливается как result["dictionary"][поле][индекс].
+    """
+    dictionary: Dict[str, list] = {name: [] for name in DICTIONARY_FIELDS}
+    codes: Dict[str, Dict[Any, int]] = {name: {} for name in DICTIONARY_FIELDS}
+    for op in result.get("operations") or []:
+        for name in DICTIONARY_FIELDS:
+            value = op.get(name)
+            code = codes[name].get(value)
+            if code is None:
+                code = codes[name][value] = len(dictionary[name])
+                dictionary[name].append(value)
+            op[name] = code
+    result["dictionary"] = dictionary
+    return result
+
+def build_statement_result(
+    file_path: str,
+    statement_format: str,
+    aggregation_period: Optional[str],
+    include_operations: bool,
+    dictionary_encoding: bool,
+    progress: Optional[ParseProgress] = None,
+) -> Dict[str, Any]:
+    """Разбор отчета и подготовка результата к выдаче клиенту."""
+    result = serialize_operations(parse_full_statement(
+        file_path,
+        statement_format,
+        aggregation_period=aggregation_period,
+        include_operations=include_operations,
+        progress=progress,
+    ))
+    if dictionary_encoding:
+        result = dictionary_encode_operations(result)
+    return result
+
 @app.post(
     "/parse-financial-operations",
     response_model=Dict[str, Any],
@@ -78,15 +302,25 @@ def serialize_operations(result: Dict[str, Any]) -> Dict[str, Any]:
 )
 async def parse_file(
     file: UploadFile = File(..., description="Excel файл с финансовыми операциями"),
-    file_extension: str = Depends(validate_file_extension)
+    file_extension: str = Depends(validate_file_extension),
+    statement_format: str = Depends(validate_statement_format),
+    aggregation_period: Optional[str] = Depends(validate_aggregation_period),
+    include_operations: bool = Query(True, description="Возвращать список операций"),
+    dictionary_encoding: bool = Query(False, description="Кодировать повторяющиеся строки словарем")
 ):
     """Обрабатывает загруженный Excel файл и извлекает финансовые операции."""
-    temp_path = await save_upload_file_tmp(file)
-    logger.info(f"Обработка файла: {file.filename} ({file_extension}), путь: {temp_path}")
+    upload = await save_upload_file_tmp(file)
+    temp_path = upload.path
+    logger.info(
+        f"Обработка файла: {file.filename} ({upload.extension}, {upload.size} байт, "
+        f"sha256 {upload.sha256}), путь: {temp_path}"
+    )
 
     try:
-        result = parse_full_statement(temp_path)
-        return JSONResponse(content=serialize_operations(result))
+        result = build_statement_result(
+            temp_path, statement_format, aggregation_period, include_operations, dictionary_encoding
+        )
+        return JSONResponse(content=result)
     except Exception as e:
         logger.exception(f"Ошибка при парсинге файла: {e}")
         raise HTTPException(status_code=422, detail=f"Ошибка при парсинге файла: {e}")
@@ -97,6 +331,73 @@ async def parse_file(
         except Exception as e:
             logger.warning(f"Не удалось удалить временный файл {temp_path}: {e}")
 
+@app.post(
+    "/jobs",
+    status_code=202,
+    response_model=Dict[str, Any],
+    summary="Фоновый парсинг большого отчета",
+    description="Загрузите XLS или XLSX файл; разбор выполняется в фоне, результат забирается по job_id"
+)
+async def submit_job(
+    file: UploadFile = File(..., description="Excel файл с финансовыми операциями"),
+    file_extension: str = Depends(validate_file_extension),
+    statement_format: str = Depends(validate_statement_format),
+    aggregation_period: Optional[str] = Depends(validate_aggregation_period),
+    include_operations: bool = Query(True, description="Возвращать список операций"),
+    dictionary_encoding: bool = Query(False, description="Кодировать повторяющиеся строки словарем")
+):
+    """Сохраняет файл и ставит задачу разбора в очередь; сразу возвращает job_id."""
+    job_id = new_job_id()
+    upload = await save_upload_file_tmp(file, job_manager.work_dir, job_id)
+    logger.info(
+        f"Задача {job_id}: файл {file.filename} ({upload.extension}, {upload.size} байт, sha256 {upload.sha256})"
+    )
+
+    def task(path: str, progress: ParseProgress) -> Dict[str, Any]:
+        return build_statement_result(
+            path, statement_format, aggregation_period, include_operations, dictionary_encoding, progress
+        )
+
+    try:
+        job = job_manager.submit(job_id, file.filename, upload.extension, task)
+    except JobStoreFullError as e:
+        os.unlink(upload.path)
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.to_dict()
+
+def get_job_or_404(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Задача не найдена: {job_id}")
+    return job
+
+@app.get("/jobs/{job_id}", response_model=Dict[str, Any], summary="Статус фоновой задачи")
+async def get_job_status(job_id: str):
+    """Статус задачи и ход разбора: текущий раздел и число обработанных строк."""
+    return get_job_or_404(job_id).to_dict()
+
+@app.get("/jobs/{job_id}/result", summary="Результат фоновой задачи")
+async def get_job_result(
+    job_id: str,
+    compressed: bool = Query(False, description="Отдать результат в gzip без распаковки")
+):
+    """Отдает результат завершенной задачи (JSON или JSON в gzip)."""
+    job = get_job_or_404(job_id)
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=422, detail=f"Ошибка при парсинге файла: {job.error}")
+    if job.status != JOB_DONE:
+        raise HTTPException(status_code=409, detail=f"Задача еще не завершена: {job.status}")
+    result_path = job_manager.result_path(job.job_id)
+    if compressed:
+        return FileResponse(result_path, media_type="application/gzip", filename=f"{job_id}.json.gz")
+
+    def iter_result():
+        with gzip.open(result_path, "rb") as f:
+            while chunk := f.read(RESULT_CHUNK_SIZE):
+                yield chunk
+
+    return StreamingResponse(iter_result(), media_type="application/json")
+
 @app.get("/health", response_model=Dict[str, str])
 async def health_check():
     """Проверка состояния сервиса."""
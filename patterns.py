@@ -0,0 +1,42 @@
+import re
+from typing import Optional
+
+#  Скомпилированные регулярные выражения разбора отчетов.
+#  Перед каждым стоит дешевая проверка (длина, префикс, подстрока), которая
+#  является необходимым условием совпадения, — большинство ячеек до regex не доходят.
+
+ISIN_RE = re.compile(r'\b[A-Z]{2}[A-Z0-9]{10}\b')
+CURRENCY_PAIR_RE = re.compile(r'^[A-Z]{3,}RUB_[A-Z]+$')
+RU_TICKER_RE = re.compile(r'^RU\d{9}$')
+SECTION_NUMBER_RE = re.compile(r'^(\d+(?:\.\d+)*)\.\s')
+ACCOUNT_ID_RE = re.compile(r"Генеральное соглашение:\s*(\d+)")
+ACCOUNT_DATE_RE = re.compile(r"от\s+(\d{2}\.\d{2}\.\d{4})")
+
+ISIN_LENGTH = 12
+RU_TICKER_LENGTH = 11
+
+
+def find_isin(text: str) -> str:
+    """Первый ISIN-подобный код (2 буквы + 10 букв/цифр) в тексте или ''."""
+    if len(text) < ISIN_LENGTH:
+        return ""
+    match = ISIN_RE.search(text)
+    return match.group(0) if match else ""
+
+
+def is_currency_pair(text: str) -> bool:
+    """Тикер валютной пары вида USDRUB_TOM."""
+    return "RUB_" in text and CURRENCY_PAIR_RE.match(text) is not None
+
+
+def is_ru_ticker(text: str) -> bool:
+    """Код вида RU + 9 цифр (text уже без пробелов по краям)."""
+    return len(text) == RU_TICKER_LENGTH and text.startswith("RU") and RU_TICKER_RE.match(text) is not None
+
+
+def match_section_number(text: str) -> Optional[str]:
+    """Номер раздела из заголовка вида "2.1. Сделки:" или None."""
+    if not text[:1].isdigit():
+        return None
+    match = SECTION_NUMBER_RE.match(text)
+    return match.group(1) if match else None
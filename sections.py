@@ -0,0 +1,204 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from constants import SECTION_KEYWORDS
+from format_profiles import FormatProfile, get_profile
+from patterns import is_currency_pair, match_section_number
+
+
+@dataclass
+class SectionIndex:
+    """
+    Индекс разделов отчета: диапазоны строк, которые нужны каждому парсеру.
+    Строится одним проходом по строкам файла в build_section_index.
+    """
+    header: range = range(0)
+    cash_header_row: Optional[int] = None
+    currency_blocks: List[Tuple[Optional[str], range]] = field(default_factory=list)
+    trades: range = range(0)
+    trade_subsections: List[Tuple[str, range]] = field(default_factory=list)
+
+
+@dataclass
+class ParseProgress:
+    """
+    Ход разбора отчета: текущий раздел и число обработанных строк.
+    Обновляется парсерами на границах разделов и блоков.
+    """
+    section: str = "queued"
+    rows_processed: int = 0
+    rows_total: int = 0
+
+    def update(self, section: str, rows_processed: int) -> None:
+        self.section = section
+        self.rows_processed = rows_processed
+
+
+def join_row(row: List[Any]) -> str:
+    return " ".join(str(c).strip() for c in row if c).strip()
+
+
+def is_cash_table_header(row_str: str, keywords: Tuple[str, ...]) -> bool:
+    lowered = row_str.lower()
+    return all(k in lowered for k in keywords)
+
+
+ROW_OTHER = 0
+ROW_CURRENCY = 1
+ROW_TRADES_MARKER = 2
+ROW_CASH_HEADER = 3
+
+
+class RowClassifier:
+    """
+    Классификатор строк до раздела сделок, собранный один раз из профиля формата:
+    маркер валюты / маркер раздела сделок / заголовок таблицы ДС / прочая строка.
+    Строка целиком склеивается только для поиска заголовка таблицы.
+    """
+
+    def __init__(self, profile: FormatProfile) -> None:
+        self.currencies = profile.currencies
+        self.trades_marker = profile.trades_marker
+        self.marker_prefix = profile.trades_section_number
+        self.cash_table_header = profile.cash_table_header
+
+    def classify(self, row: List[Any], find_header: bool) -> Tuple[int, Optional[str]]:
+        """
+        Тип строки и, для маркера валюты, нормализованная валюта.
+        Совпадает с проверками по join_row(row): валюта — единственная непустая ячейка.
+        """
+        single: Optional[str] = None
+        filled = 0
+        marker = self.trades_marker
+        for pos, cell in enumerate(row):
+            if not cell:
+                continue
+            if isinstance(cell, str):
+                text = cell.strip()
+                if not text:
+                    continue
+                if pos and marker and self.marker_prefix in text and marker in text.lower():
+                    return ROW_TRADES_MARKER, None
+            else:
+                text = None
+            filled += 1
+            if filled == 1:
+                single = text if text is not None else str(cell).strip()
+
+        if filled == 1 and single in self.currencies:
+            return ROW_CURRENCY, self.currencies[single]
+        if find_header and is_cash_table_header(join_row(row), self.cash_table_header):
+            return ROW_CASH_HEADER, None
+        return ROW_OTHER, None
+
+
+def is_section_end(cells: List[Any], section_number: str) -> bool:
+    """
+    Заголовок следующего раздела отчета ("2.2. ...", "3. Активы:" и т.д.),
+    которым заканчивается раздел "2.1. Сделки:".
+    """
+    for cell in cells:
+        if cell is None or cell == "":
+            continue
+        if not isinstance(cell, str):
+            return False
+        number = match_section_number(cell.strip())
+        if number is None:
+            return False
+        return number != section_number and not number.startswith(section_number + ".")
+    return False
+
+
+def is_trade_noise_row(cells: List[Any]) -> bool:
+    """Строки "итого по ..." и пустые строки в разделе сделок."""
+    joined_row = ' '.join(map(str, cells)).strip().lower()
+    return 'итого по' in joined_row or not any(cell for cell in cells)
+
+
+def match_currency_pair(cells: List[Any]) -> Optional[str]:
+    """Тикер валютной пары (CNYRUB_TOM, USDRUB_TOM и т.д.) в первой ячейке."""
+    if isinstance(cells[0], str) and is_currency_pair(cells[0]):
+        return cells[0].strip()
+    return None
+
+
+def is_isin_row(cells: List[Any]) -> bool:
+    return any(isinstance(cell, str) and 'isin' in cell.lower() for cell in cells)
+
+
+def detect_trade_section(
+    cells: List[Any],
+    section_keywords: Optional[Dict[str, list]] = None
+) -> Optional[str]:
+    for section, keywords in (section_keywords or SECTION_KEYWORDS).items():
+        if any(keyword in str(cell).lower() for cell in cells for keyword in keywords):
+            return section
+    return None
+
+
+def build_section_index(rows: List[List[Any]], profile: Optional[FormatProfile] = None) -> SectionIndex:
+    """
+    Один проход по строкам отчета с построением диапазонов:
+    - метаданные шапки (до заголовка таблицы движения ДС);
+    - блоки валют внутри таблицы движения ДС;
+    - раздел "2.1. Сделки:" и его подразделы (акции, облигации, валюта).
+    Сканирование останавливается на заголовке раздела, следующего за сделками.
+    Маркеры разделов и валюты берутся из профиля формата profile.
+    """
+    profile = profile or get_profile()
+    classifier = RowClassifier(profile)
+    marker_prefix = profile.trades_section_number
+    total = len(rows)
+    index = SectionIndex()
+    current_currency: Optional[str] = None
+    block_start: Optional[int] = None
+    trades_start: Optional[int] = None
+    trades_end = total
+    section_starts: List[Tuple[str, int]] = []
+
+    def close_block(end: int) -> None:
+        if block_start is not None and block_start < end:
+            index.currency_blocks.append((current_currency, range(block_start, end)))
+
+    for i, row in enumerate(rows):
+        if trades_start is None:
+            kind, currency = classifier.classify(row, index.cash_header_row is None)
+            if kind == ROW_CURRENCY:
+                close_block(i)
+                current_currency = currency
+                if index.cash_header_row is not None:
+                    block_start = i + 1
+            elif kind == ROW_TRADES_MARKER:
+                close_block(i)
+                block_start = None
+                trades_start = i + 1
+            elif kind == ROW_CASH_HEADER:
+                index.cash_header_row = i
+                block_start = i + 1
+            continue
+
+        cells = row[1:]
+        if marker_prefix and is_section_end(cells, marker_prefix):
+            trades_end = i
+            break
+        if is_trade_noise_row(cells) or match_currency_pair(cells) or is_isin_row(cells):
+            continue
+        section = detect_trade_section(cells, profile.section_keywords)
+        if section:
+            section_starts.append((section, i))
+
+    if trades_start is None:
+        close_block(total)
+        scan_end = total
+    else:
+        scan_end = trades_start - 1
+        index.trades = range(trades_start, trades_end)
+
+    header_end = index.cash_header_row if index.cash_header_row is not None else scan_end
+    index.header = range(0, header_end)
+
+    for pos, (section, start) in enumerate(section_starts):
+        end = section_starts[pos + 1][1] if pos + 1 < len(section_starts) else trades_end
+        index.trade_subsections.append((section, range(start, end)))
+
+    return index
@@ -0,0 +1,227 @@
+import json
+import os
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from jobs import JOB_DONE, JOB_FAILED, Job, JobManager, JobStoreFullError
+
+
+def wait_finished(manager: JobManager, job_id: str, timeout: float = 5.0) -> Job:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = manager.get(job_id)
+        if job is not None and job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"Задача {job_id} не завершилась за {timeout} с")
+
+
+def save_upload(manager: JobManager, job_id: str) -> str:
+    open(manager.new_job_path(job_id, ".xlsx"), "wb").close()
+    return "xlsx"
+
+
+@pytest.fixture
+def manager(tmp_path):
+    manager = JobManager(work_dir=str(tmp_path), workers=1, max_jobs=2, ttl_seconds=3600)
+    yield manager
+    manager.shutdown()
+
+
+def test_done_job_without_finished_at_is_not_evicted(manager):
+    job = Job(job_id="half", filename="f.xlsx", extension="xlsx", status=JOB_DONE)
+    manager._jobs[job.job_id] = job
+    manager._save(job)
+
+    assert manager.get("half") is job
+
+
+def test_finished_job_expires_after_ttl(manager):
+    manager.ttl_seconds = 0.2
+    manager.submit("a", "a.xlsx", save_upload(manager, "a"), lambda path, progress: {"ok": True})
+    job = wait_finished(manager, "a")
+    assert job.status == JOB_DONE
+    assert job.finished_at is not None
+    assert os.path.exists(manager.result_path("a"))
+
+    time.sleep(0.3)
+    assert manager.get("a") is None
+    assert not os.path.exists(manager.result_path("a"))
+
+
+def test_failed_job_keeps_error(manager):
+    def fail(path, progress):
+        raise ValueError("boom")
+
+    manager.submit("f", "f.xlsx", save_upload(manager, "f"), fail)
+    job = wait_finished(manager, "f")
+    assert job.status == JOB_FAILED
+    assert job.error == "boom"
+    assert not os.path.exists(manager.result_path("f"))
+
+
+def test_full_store_evicts_oldest_finished_job(manager):
+    for job_id in ("a", "b"):
+        manager.submit(job_id, f"{job_id}.xlsx", save_upload(manager, job_id), lambda path, progress: {})
+        wait_finished(manager, job_id)
+
+    manager.submit("c", "c.xlsx", save_upload(manager, "c"), lambda path, progress: {})
+
+    assert manager.get("a") is None
+    assert manager.get("b") is not None
+    wait_finished(manager, "c")
+
+
+def test_full_store_of_running_jobs_rejects_submit(manager):
+    release = threading.Event()
+
+    def block(path, progress):
+        release.wait(5)
+        return {}
+
+    manager.submit("a", "a.xlsx", save_upload(manager, "a"), block)
+    manager.submit("b", "b.xlsx", save_upload(manager, "b"), block)
+    try:
+        with pytest.raises(JobStoreFullError):
+            manager.submit("c", "c.xlsx", save_upload(manager, "c"), block)
+    finally:
+        release.set()
+    wait_finished(manager, "a")
+    wait_finished(manager, "b")
+
+
+def test_job_is_visible_to_another_manager_on_the_same_dir(manager):
+    other = JobManager(work_dir=manager.work_dir, workers=1, max_jobs=2, ttl_seconds=3600)
+    try:
+        manager.submit("a", "a.xlsx", save_upload(manager, "a"), lambda path, progress: {"ok": True})
+        wait_finished(manager, "a")
+
+        job = other.get("a")
+        assert job is not None
+        assert job.status == JOB_DONE
+        assert os.path.exists(other.result_path("a"))
+    finally:
+        other.shutdown()
+
+
+def test_running_job_of_dead_process_is_marked_failed(manager):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    job = Job(job_id="orphan", filename="o.xlsx", extension=save_upload(manager, "orphan"), pid=dead.pid)
+    manager._save(job)
+
+    manager._expire(force=True)
+
+    job = manager.get("orphan")
+    assert job.status == JOB_FAILED
+    assert job.finished_at is not None
+    assert not os.path.exists(manager.source_path(job))
+
+
+def test_jobs_of_restarted_owner_with_same_pid_are_failed(tmp_path):
+    for job_id in ("a", "b"):
+        open(os.path.join(tmp_path, f"{job_id}.xlsx"), "wb").close()
+        record = Job(job_id=job_id, filename="f.xlsx", extension="xlsx", owner="previous-run").to_record()
+        with open(os.path.join(tmp_path, f"{job_id}.status.json"), "w", encoding="utf-8") as f:
+            json.dump(record, f)
+
+    manager = JobManager(work_dir=str(tmp_path), workers=1, max_jobs=2, ttl_seconds=3600)
+    try:
+        assert manager.get("a").status == JOB_FAILED
+        manager.submit("c", "c.xlsx", save_upload(manager, "c"), lambda path, progress: {})
+        assert wait_finished(manager, "c").status == JOB_DONE
+    finally:
+        manager.shutdown()
+
+
+def test_unfinished_job_fails_after_max_age(manager):
+    release = threading.Event()
+
+    def block(path, progress):
+        release.wait(5)
+        return {}
+
+    manager.submit("a", "a.xlsx", save_upload(manager, "a"), block)
+    manager.max_age_seconds = 0
+    time.sleep(0.01)
+    manager._expire(force=True)
+    release.set()
+
+    job = wait_finished(manager, "a")
+    assert job.status == JOB_FAILED
+    time.sleep(0.1)
+    assert manager.get("a").status == JOB_FAILED
+    assert not os.path.exists(manager.new_job_path("a", ".json.gz"))
+
+
+def test_shutdown_fails_queued_jobs(manager):
+    release = threading.Event()
+
+    def block(path, progress):
+        release.wait(5)
+        return {}
+
+    manager.submit("a", "a.xlsx", save_upload(manager, "a"), block)
+    manager.submit("b", "b.xlsx", save_upload(manager, "b"), block)
+    try:
+        manager.shutdown()
+    finally:
+        release.set()
+
+    with open(manager.new_job_path("b", ".status.json"), encoding="utf-8") as f:
+        assert json.load(f)["status"] == JOB_FAILED
+    assert not os.path.exists(manager.new_job_path("b", ".xlsx"))
+
+
+def test_paths_in_status_file_are_not_trusted(manager, tmp_path):
+    outside = tmp_path.parent / "outside.txt"
+    outside.write_text("keep")
+    job = Job(job_id="x", filename="x.xlsx", extension="xlsx", status=JOB_DONE, finished_at=0.0)
+    record = job.to_record()
+    record.update(source_path=str(outside), result_path=str(outside))
+    with open(manager.new_job_path("x", ".status.json"), "w", encoding="utf-8") as f:
+        json.dump(record, f)
+
+    manager.ttl_seconds = 0
+    assert manager.get("x") is None
+    assert outside.read_text() == "keep"
+
+
+def test_status_file_with_foreign_extension_is_ignored(manager):
+    record = Job(job_id="x", filename="x.xlsx", extension="xlsx").to_record()
+    record["extension"] = "xlsx/../../etc/passwd"
+    with open(manager.new_job_path("x", ".status.json"), "w", encoding="utf-8") as f:
+        json.dump(record, f)
+
+    assert manager.get("x") is None
+    assert manager.get("../x") is None
+
+
+def test_work_dir_writable_by_others_is_refused(tmp_path):
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(PermissionError):
+        JobManager(work_dir=str(shared))
+
+
+def test_work_dir_is_created_private(tmp_path):
+    manager = JobManager(work_dir=str(tmp_path / "jobs"))
+    try:
+        assert stat.S_IMODE(os.stat(manager.work_dir).st_mode) & 0o077 == 0
+    finally:
+        manager.shutdown()
+
+
+@pytest.mark.skipif(not hasattr(os, "geteuid") or os.geteuid() != 0, reason="нужен root для смены владельца")
+def test_work_dir_of_another_user_is_refused(tmp_path):
+    foreign = tmp_path / "foreign"
+    foreign.mkdir(mode=0o700)
+    os.chown(foreign, 65534, 65534)
+    with pytest.raises(PermissionError):
+        JobManager(work_dir=str(foreign))
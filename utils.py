@@ -6,14 +6,10 @@ from typing import Any, Generator, List, Optional, Dict
 
 from datetime import datetime
 
+from format_profiles import DEFAULT_PROFILE, get_profile
 
-HEADER_VARIATIONS_FIN_OPS: Dict[str, list] = {
-    "date":      ["дата"],
-    "operation": ["операция"],
-    "income":    ["сумма зачисления", "зачислено"],
-    "expense":   ["сумма списания",   "списано"],
-    "comment":   ["примечание",       "назначение", "описание"],
-}
+
+HEADER_VARIATIONS_FIN_OPS: Dict[str, list] = get_profile(DEFAULT_PROFILE).header_variations_fin_ops
 
 def build_col_index_map_from_row(header_row: List[Any], variations: Dict[str, list]) -> Dict[str, int]:
     col_map: Dict[str, int] = {}
@@ -75,6 +71,24 @@ def parse_date(value: Any) -> Optional[str]:
 
     return None
 
+class StringPool:
+    """
+    Пул строк на время одного разбора отчета: равные значения (тикеры, ISIN,
+    валюты, типы операций, комментарии) хранятся в одном экземпляре.
+    """
+
+    def __init__(self) -> None:
+        self._pool: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._pool)
+
+    def intern(self, value: Optional[str]) -> Optional[str]:
+        if not value:
+            return value
+        return self._pool.setdefault(value, value)
+
+
 def normalize_str(value: Any) -> str:
     s = str(value).strip() if value is not None else ""
     return "" if s.lower() == "none" else s